@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.WARM_UP_ON_BOOT:
+    from .warmup import warm_up
+    warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,16 +44,20 @@ INSTALLED_APPS = [
     'djoser',
 ]
 
+# Sessions, CSRF, auth and messages are skipped for requests under API_PATH_PREFIX,
+# which authenticate with tokens (see LittleLemon/middleware.py)
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'LittleLemon.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'LittleLemon.middleware.CsrfViewMiddleware',
+    'LittleLemon.middleware.AuthenticationMiddleware',
+    'LittleLemon.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+API_PATH_PREFIX = '/api/'
+
 ROOT_URLCONF = 'LittleLemon.urls'
 
 TEMPLATES = [
@@ -81,9 +86,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than in-memory, so that concurrency tests get SQLite's real locking
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Local SQLite databases to try out the order shards, e.g. ORDER_SHARDS = ['default', 'orders_1', 'orders_2']
+# Create their tables with `manage.py migrate --database orders_1`
+for _shard in ['orders_1', 'orders_2']:
+    DATABASES[_shard] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{_shard}.sqlite3',
+        'TEST': {
+            'NAME': BASE_DIR / f'test_{_shard}.sqlite3',
+        },
+    }
+
+# Databases holding orders, order items, carts and outbox events, sharded by user (see LittleLemonAPI/sharding.py)
+# Run `manage.py rebalance_orders` after changing it
+ORDER_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['LittleLemonAPI.sharding.OrderShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -139,3 +165,85 @@ REST_FRAMEWORK = {
         'user': '5/minute',
     }
 }
+
+# Batch endpoint (/api/batch)
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+# Users added to or removed from a group in one request
+GROUPS_MAX_USERS = 100
+
+# Admin changelists count rows exactly up to this many, and estimate beyond (see LittleLemonAPI/admin.py)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Delivered orders older than this are moved to the archive tables by `manage.py archive_orders`
+ORDER_ARCHIVE_AFTER_DAYS = 90
+
+# Load the URL conf and serializers when the WSGI/ASGI application starts, instead of on the first request
+WARM_UP_ON_BOOT = False
+
+def _shared_cache(name, **options):
+    """A cache seen by every worker: Redis when REDIS_URL is set (needs the redis package), else files on this host"""
+    if os.environ.get('REDIS_URL'):
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': name,
+        }
+    return {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / name,
+        'OPTIONS': options,
+    }
+
+CACHES = {
+    # Private to each process
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': _shared_cache('shared', MAX_ENTRIES=10000),
+    # Carts of CacheCartStore, never culled since a cart dropped from it is lost.
+    # With Redis, use an instance whose maxmemory-policy is noeviction.
+    'carts': _shared_cache('carts', MAX_ENTRIES=10 ** 9),
+}
+
+# Cache holding the pre-rendered menu and the filtered menu lists (see LittleLemonAPI/snapshots.py)
+MENU_SNAPSHOT_CACHE = 'shared'
+
+# Upper bounds of the price buckets counted by /api/menu-items?facets=1
+MENU_PRICE_BUCKETS = [5, 10, 20]
+
+# Where carts are kept: LittleLemonAPI.carts.DatabaseCartStore, or CacheCartStore to keep cart changes off the database
+CART_STORE = 'LittleLemonAPI.carts.DatabaseCartStore'
+# Must be shared by the workers and never cull entries: the system checks reject per-process caches
+CART_CACHE = 'carts'
+CART_CACHE_TIMEOUT = 60 * 60 * 24
+CART_MAX_ITEMS = 50
+
+# Responses replayed for retried requests with the same Idempotency-Key (see LittleLemonAPI/idempotency.py),
+# kept in the database and deleted by `manage.py purge_idempotency_keys`
+IDEMPOTENCY_TIMEOUT = 60 * 60 * 24
+# How long a key stays reserved by a request that is still running
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Filtered menu lists are cached for this many seconds, then served stale for up to
+# MENU_LIST_STALE_TIMEOUT more while one request refreshes them (see LittleLemonAPI/coalescing.py)
+MENU_LIST_CACHE_TIMEOUT = 60
+MENU_LIST_STALE_TIMEOUT = 300
+# How long a process may hold the lock on a cache refresh, and how often others check for its result
+COALESCE_LOCK_TIMEOUT = 10
+COALESCE_POLL_INTERVAL = 0.05
+
+# Order events are POSTed to these URLs by `manage.py dispatch_outbox` (see LittleLemonAPI/outbox.py)
+OUTBOX_ENDPOINTS = []
+OUTBOX_TIMEOUT = 10
+# Seconds before the first retry of a failed batch, doubling on every attempt up to OUTBOX_MAX_BACKOFF
+OUTBOX_BACKOFF = 5
+OUTBOX_MAX_BACKOFF = 60 * 60
+
+# Background jobs run by `manage.py run_jobs` (see LittleLemonAPI/jobs.py)
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_BACKOFF = 10
+JOBS_LOCK_TIMEOUT = 60 * 10
+# Due jobs a worker tries to claim per poll, where it can't skip the ones locked by other workers
+JOBS_CLAIM_CANDIDATES = 10
@@ -0,0 +1,50 @@
+"""
+Slim settings for the API workers
+
+Only loads what the API needs: no admin, sessions, messages or static files, and JSON rendering only.
+Use with DJANGO_SETTINGS_MODULE=LittleLemon.settings_production, and SECRET_KEY and ALLOWED_HOSTS in the environment
+"""
+import os
+
+from .settings import *
+
+DEBUG = False
+
+# Required: Django refuses to start with an empty key
+SECRET_KEY = os.environ.get('SECRET_KEY', '')
+
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost').split(',')
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'LittleLemonAPI',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'djoser',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [],
+        },
+    },
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
+
+WARM_UP_ON_BOOT = True
@@ -0,0 +1,34 @@
+"""
+Does at boot the work Django would otherwise do on the first request:
+importing and compiling the URL conf, and building the serializer fields (which fills the model _meta caches)
+"""
+from django.urls import get_resolver, URLResolver
+from rest_framework.serializers import Serializer
+
+
+def _compile(resolver):
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            _compile(pattern)
+
+def _subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+def warm_up():
+    resolver = get_resolver()
+    resolver.reverse_dict
+    _compile(resolver)
+
+    # Importing the URL conf has imported every view, and with them the serializers
+    for serializer_class in _subclasses(Serializer):
+        if serializer_class.__module__.startswith('rest_framework.'):
+            continue
+        try:
+            serializer_class().fields
+        except (TypeError, KeyError, AttributeError):
+            # Serializers whose constructor needs arguments, or whose fields read the context or the instance,
+            # are built on first use instead. Any other error is a broken serializer, and fails the boot.
+            pass
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.WARM_UP_ON_BOOT:
+    from .warmup import warm_up
+    warm_up()
@@ -1,11 +1,289 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import Category, MenuItem
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import QueryDict
+from django.utils.functional import cached_property
+from .models import Category, MenuItem, Cart, Order, OrderItem, GlobalIdModel, SHARD_ID_STRIDE
+from .outbox import record_order_events
+from .sharding import get_shards, is_sharded
+from .stats import record_deliveries, update_status
+
+
+def estimate_rows(model, using):
+    """Row count of the model's table from the database statistics (ANALYZE), or None if there are none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+    return None
+
+
+def estimate_rows_from_ids(queryset):
+    """
+    Row count of the queryset's table from the range of its ids, for databases without statistics
+    Each end is read from the primary key index: SQLite only does that for a single MIN() or MAX() per query
+    """
+    first = queryset.order_by('pk').values_list('pk', flat=True).first()
+    last = queryset.order_by('-pk').values_list('pk', flat=True).first()
+    if not isinstance(first, int):
+        return 0
+    # Sharded ids are spaced by the stride (see allocate_ids)
+    step = SHARD_ID_STRIDE if issubclass(queryset.model, GlobalIdModel) else 1
+    return (last - first) // step + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts up to ADMIN_EXACT_COUNT_LIMIT rows, without scanning the rest
+    Larger unfiltered lists use the row count of the database statistics, or else the range of their ids;
+    larger filtered lists stop at the limit
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        count = queryset.order_by()[:limit + 1].count()
+        if count <= limit or queryset.query.has_filters():
+            return count
+        estimate = estimate_rows(queryset.model, queryset.db)
+        if estimate is None:
+            estimate = estimate_rows_from_ids(queryset)
+        return max(count, estimate)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Changelists that neither count whole tables nor look up related rows one by one"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Numeric terms also match the id, through the primary key"""
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term.strip().isdigit():
+            results |= queryset.filter(pk=int(search_term))
+        return results, may_have_duplicates
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Picks the order shard shown by a ShardedAdmin, the first of ORDER_SHARDS by default. Hidden with a single one."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(db, db) for db in get_shards()]
+
+    def has_output(self):
+        return len(get_shards()) > 1
+
+    def choices(self, changelist):
+        selected = self.value() or get_shards()[0]
+        for (db, title) in self.lookup_choices:
+            yield {
+                'selected': db == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: db}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # ShardedAdmin.get_queryset already reads the shard
+        return queryset
+
+
+def get_admin_shard(request):
+    """The shard picked by the ShardListFilter of the changelist, or of the changelist a change form was opened from"""
+    shard = request.GET.get(ShardListFilter.parameter_name)
+    if shard is None:
+        shard = QueryDict(request.GET.get('_changelist_filters', '')).get(ShardListFilter.parameter_name)
+    return shard if shard in get_shards() else get_shards()[0]
+
+
+class ShardedAdmin(ScalableAdmin):
+    """
+    Admin of a model kept in the order shards (see sharding.py), showing one shard at a time, picked by ShardListFilter
+    Change forms opened from the changelist keep its filters, so they read the same shard
+    Users and menu items are in the default database, which the other shards can't join: their related rows are
+    prefetched, and searches look them up first
+    """
+
+    def get_list_filter(self, request):
+        return (ShardListFilter,) + tuple(super().get_list_filter(request))
+
+    def get_list_select_related(self, request):
+        if get_admin_shard(request) == DEFAULT_DB_ALIAS:
+            return super().get_list_select_related(request)
+        # Not False, which joins every relation shown
+        return ()
+
+    def get_queryset(self, request):
+        shard = get_admin_shard(request)
+        queryset = super().get_queryset(request).using(shard)
+        if shard != DEFAULT_DB_ALIAS:
+            queryset = queryset.prefetch_related(*self.list_select_related)
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if queryset.db == DEFAULT_DB_ALIAS or not term:
+            return super().get_search_results(request, queryset, search_term)
+        # Only exact searches through a relation, like '=user__username'
+        results = queryset.none()
+        for field in self.search_fields:
+            relation, lookup = field.lstrip('=').split('__', 1)
+            related_model = self.model._meta.get_field(relation).related_model
+            if is_sharded(related_model):
+                results |= queryset.filter(**{field.lstrip('='): term})
+            else:
+                ids = related_model.objects.filter(**{lookup: term}).values_list('pk', flat=True)
+                results |= queryset.filter(**{f'{relation}__in': list(ids)})
+        if term.isdigit():
+            results |= queryset.filter(pk=int(term))
+        return results, False
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     pass
 
 @admin.register(MenuItem)
-class MenuItemAdmin(admin.ModelAdmin):
+class MenuItemAdmin(ScalableAdmin):
     list_display = ('title', 'category', 'price',)
-    list_filter = ('category',)
\ No newline at end of file
+    list_filter = ('category',)
+    list_select_related = ('category',)
+    # Needed by the autocomplete of menu items
+    search_fields = ('title',)
+
+
+class OrderActionForm(ActionForm):
+    delivery_crew = forms.ModelChoiceField(
+        queryset=User.objects.filter(groups__name='Delivery Crew'), required=False, label='Delivery crew')
+
+
+def update_orders(queryset, **fields):
+    """
+    Applies the changes to all the selected orders, in one UPDATE (one per user for status changes, see update_status)
+    Keeps the order statistics and the outbox up to date, like the bulk update of /api/orders
+    """
+    orders = list(queryset.order_by().values_list('id', 'user'))
+    updated = Order.objects.using(queryset.db).filter(id__in=[id for (id, user) in orders])
+    status = fields.pop('status', None)
+    deliveries = []
+    with transaction.atomic(using=queryset.db):
+        if status is not None:
+            deliveries = update_status(queryset.db, orders, status)
+        if len(fields) > 0:
+            updated.update(**fields)
+        record_order_events('order.updated', list(updated))
+    record_deliveries(deliveries)
+    return len(orders)
+
+
+class ReadOnlyAdminMixin:
+    """
+    Rows only created and changed through the API, which keeps the statistics, the stock and the outbox up to date
+    """
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class OrderItemInline(ReadOnlyAdminMixin, admin.TabularInline):
+    model = OrderItem
+    extra = 0
+
+    def get_queryset(self, request):
+        # In the shard of the order
+        return super().get_queryset(request).using(get_admin_shard(request))
+
+@admin.register(Order)
+class OrderAdmin(ShardedAdmin):
+    """
+    Orders of one shard at a time
+    Only the delivery crew and the status can be changed, through update_orders, like the actions
+    """
+    list_display = ('id', 'user', 'delivery_crew', 'status', 'total', 'date',)
+    list_filter = ('status',)
+    list_select_related = ('user', 'delivery_crew',)
+    # Exact matches, through the unique index on usernames
+    search_fields = ('=user__username', '=delivery_crew__username',)
+    autocomplete_fields = ('delivery_crew',)
+    readonly_fields = ('user', 'total', 'date',)
+    inlines = (OrderItemInline,)
+    ordering = ('-id',)
+    action_form = OrderActionForm
+    actions = ('assign_delivery_crew', 'mark_delivered', 'mark_not_delivered',)
+
+    def has_add_permission(self, request):
+        # Orders are created at checkout, which takes the stock and counts them in the statistics
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        fields = {name: getattr(obj, name) for name in form.changed_data}
+        if len(fields) > 0:
+            update_orders(Order.objects.using(obj._state.db).filter(id=obj.id), **fields)
+
+    @admin.action(description='Assign the selected orders to the delivery crew')
+    def assign_delivery_crew(self, request, queryset):
+        try:
+            crew = OrderActionForm.base_fields['delivery_crew'].clean(request.POST.get('delivery_crew'))
+        except ValidationError:
+            crew = None
+        if crew is None:
+            self.message_user(request, 'Choose a delivery crew member first', level='error')
+            return
+        count = update_orders(queryset, delivery_crew=crew)
+        self.message_user(request, f'Assigned {count} orders')
+
+    @admin.action(description='Mark the selected orders delivered')
+    def mark_delivered(self, request, queryset):
+        count = update_orders(queryset, status=True)
+        self.message_user(request, f'Marked {count} orders delivered')
+
+    @admin.action(description='Mark the selected orders not delivered')
+    def mark_not_delivered(self, request, queryset):
+        count = update_orders(queryset, status=False)
+        self.message_user(request, f'Marked {count} orders not delivered')
+
+@admin.register(OrderItem)
+class OrderItemAdmin(ReadOnlyAdminMixin, ShardedAdmin):
+    list_display = ('id', 'order', 'menuitem', 'quantity', 'price',)
+    list_select_related = ('order', 'menuitem',)
+    search_fields = ('=order__id',)
+    autocomplete_fields = ('order', 'menuitem',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # The order id is the only search, and must be a number
+        if search_term.strip() and not search_term.strip().isdigit():
+            return queryset.none(), False
+        return super().get_search_results(request, queryset, search_term)
+
+@admin.register(Cart)
+class CartAdmin(ShardedAdmin):
+    list_display = ('id', 'user', 'menuitem', 'quantity', 'price',)
+    list_select_related = ('user', 'menuitem',)
+    search_fields = ('=user__username',)
+    autocomplete_fields = ('user', 'menuitem',)
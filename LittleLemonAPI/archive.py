@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from .sharding import get_shards
+
+
+def archive_cutoff():
+    """Delivered orders older than this date are moved to the archive"""
+    return date.today() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+
+def archive_orders(before, batch_size=500):
+    """
+    Moves delivered orders dated before the given date, with their items, to the archive tables
+    Each batch is its own transaction, so an interrupted run can simply be started again
+    Returns the number of orders archived
+    """
+    archived = 0
+    for db in get_shards():
+        archived += _archive_shard(db, before, batch_size)
+    return archived
+
+def _archive_shard(db, before, batch_size):
+    archived = 0
+    while True:
+        with transaction.atomic(using=db):
+            orders = list(Order.objects.using(db).filter(status=True, date__lt=before).order_by('id')[:batch_size])
+            if len(orders) == 0:
+                return archived
+
+            ArchivedOrder.objects.using(db).bulk_create([ArchivedOrder(
+                id=order.id,
+                user_id=order.user_id,
+                delivery_crew_id=order.delivery_crew_id,
+                status=order.status,
+                total=order.total,
+                date=order.date,
+            ) for order in orders])
+            ArchivedOrderItem.objects.using(db).bulk_create([ArchivedOrderItem(
+                order_id=item.order_id,
+                menuitem_id=item.menuitem_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                price=item.price,
+            ) for item in OrderItem.objects.using(db).filter(order__in=orders)])
+            Order.objects.using(db).filter(id__in=[order.id for order in orders]).delete()
+
+        archived += len(orders)
+
+def reaches_archive(date_from, date_to):
+    """
+    Whether a date filter can match archived orders
+    Unfiltered requests only read recent orders; the archive is read when the range starts on or before its newest order
+    """
+    if date_from is None and date_to is None:
+        return False
+    dates = [ArchivedOrder.objects.using(db).aggregate(Max('date'))['date__max'] for db in get_shards()]
+    dates = [newest for newest in dates if newest is not None]
+    return len(dates) > 0 and (date_from is None or date_from <= max(dates))
@@ -0,0 +1,131 @@
+"""
+Cart storage
+
+CartView and checkout go through the store named by the CART_STORE setting. Both stores return Cart
+instances; the cache store never saves them, and carts only reach the database as order items at checkout.
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+from .models import Cart
+from .sharding import shard_for_user
+
+
+def get_cart_store():
+    return import_string(settings.CART_STORE)()
+
+class CartStore:
+    def list(self, user):
+        """The user's cart lines, as Cart instances"""
+        raise NotImplementedError
+
+    def set(self, user, menuitem, quantity):
+        """
+        Sets the quantity of a menu item in the cart, at its current price
+        A quantity of 0 removes it. Returns the cart line, or None if removed.
+        """
+        raise NotImplementedError
+
+    def remove(self, user, lines):
+        """
+        Removes the given lines (e.g. once ordered)
+        Called in the checkout transaction of the user's shard: stores outside the database wait for it to commit
+        """
+        raise NotImplementedError
+
+    def clear(self, user):
+        raise NotImplementedError
+
+class DatabaseCartStore(CartStore):
+    """Carts in the Cart table, in the shard of the user"""
+
+    def _carts(self, user):
+        if user.id is None:
+            # Anonymous users have no cart, nor a shard
+            return Cart.objects.none()
+        return Cart.objects.using(shard_for_user(user.id))
+
+    def list(self, user):
+        return list(self._carts(user).filter(user=user.id))
+
+    def set(self, user, menuitem, quantity):
+        # Delete any existing item for this user:menuitem (will be replaced)
+        self._carts(user).filter(user=user, menuitem=menuitem).delete()
+        if quantity > 0:
+            return self._carts(user).create(
+                user=user,
+                menuitem=menuitem,
+                quantity=quantity,
+                unit_price=menuitem.price,
+                price=menuitem.price * quantity,
+            )
+
+    def remove(self, user, lines):
+        self._carts(user).filter(id__in=[line.id for line in lines]).delete()
+
+    def clear(self, user):
+        self._carts(user).filter(user=user).delete()
+
+class CacheCartStore(CartStore):
+    """
+    Carts in the cache named by CART_CACHE, one entry per user. The cache is their only copy: it must be shared by
+    the workers and never cull entries, like the 'carts' cache of the settings (checked at startup, see checks.py)
+    Abandoned carts expire after CART_CACHE_TIMEOUT seconds without changes, and carts hold at most CART_MAX_ITEMS lines
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.CART_CACHE]
+
+    def _key(self, user):
+        return f'cart:{user.id}'
+
+    def _load(self, user):
+        # {menuitem id: (quantity, unit price)}
+        return self.cache.get(self._key(user), {})
+
+    def _save(self, user, lines):
+        if len(lines) == 0:
+            self.cache.delete(self._key(user))
+        else:
+            self.cache.set(self._key(user), lines, timeout=settings.CART_CACHE_TIMEOUT)
+
+    def _line(self, user, menuitem_id, quantity, unit_price):
+        unit_price = Decimal(unit_price)
+        return Cart(user=user, menuitem_id=menuitem_id, quantity=quantity,
+                    unit_price=unit_price, price=unit_price * quantity)
+
+    def list(self, user):
+        if not user.is_authenticated:
+            return []
+        return [self._line(user, menuitem_id, quantity, unit_price)
+                for menuitem_id, (quantity, unit_price) in sorted(self._load(user).items())]
+
+    def set(self, user, menuitem, quantity):
+        lines = self._load(user)
+        lines.pop(menuitem.id, None)
+        line = None
+        if quantity > 0:
+            if len(lines) >= settings.CART_MAX_ITEMS:
+                raise ValidationError({'menuitem': f'A cart can hold at most {settings.CART_MAX_ITEMS} items'})
+            lines[menuitem.id] = (quantity, str(menuitem.price))
+            line = self._line(user, menuitem.id, quantity, menuitem.price)
+        self._save(user, lines)
+        return line
+
+    def remove(self, user, lines):
+        # A rolled back checkout keeps the cart
+        transaction.on_commit(lambda: self._remove(user, lines), using=shard_for_user(user.id))
+
+    def _remove(self, user, lines):
+        stored = self._load(user)
+        for line in lines:
+            # Keep lines changed since they were read
+            if stored.get(line.menuitem_id, (None,))[0] == line.quantity:
+                del stored[line.menuitem_id]
+        self._save(user, stored)
+
+    def clear(self, user):
+        self.cache.delete(self._key(user))
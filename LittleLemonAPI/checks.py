@@ -0,0 +1,29 @@
+"""
+System checks of the settings that must hold in deployments with several workers
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+
+# Caches that each process keeps to itself
+PRIVATE_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+@register()
+def check_cart_cache(app_configs, **kwargs):
+    """The cart cache is the only copy of the carts, so every worker must see the same one"""
+    from .carts import CacheCartStore
+
+    if not issubclass(import_string(settings.CART_STORE), CacheCartStore):
+        return []
+    backend = settings.CACHES.get(settings.CART_CACHE, {}).get('BACKEND')
+    if backend in PRIVATE_CACHES:
+        return [Error(
+            f'CART_CACHE {settings.CART_CACHE!r} is private to each process, so carts would be lost between workers',
+            hint='Point CART_CACHE to a shared cache that never culls entries, like the "carts" cache',
+            id='LittleLemonAPI.E001',
+        )]
+    return []
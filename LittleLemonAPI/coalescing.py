@@ -0,0 +1,105 @@
+"""
+Request coalescing for expensive cached reads
+
+When a cached value is missing or stale, only one computation runs at a time: concurrent callers in the
+same process wait for it (single flight), and other processes see a lock in the shared cache.
+Callers that find a stale value don't wait, they get the stale value while it is being refreshed.
+
+A value is stale once its timeout has passed, or if it was computed for another version of the data.
+It stays in the cache, usable as stale, for stale_timeout more seconds.
+"""
+import threading
+import time
+from django.conf import settings
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def _is_fresh(entry, version):
+    if entry is None or entry['version'] != version:
+        return False
+    return entry['fresh_until'] is None or entry['fresh_until'] > time.time()
+
+def _store(cache, key, value, version, timeout, stale_timeout):
+    if timeout is None:
+        fresh_until = None
+    else:
+        fresh_until = time.time() + timeout
+        timeout += stale_timeout
+    cache.set(key, {'value': value, 'version': version, 'fresh_until': fresh_until}, timeout=timeout)
+
+def _compute(cache, key, compute, version, timeout, stale_timeout, entry):
+    """Computes the value, unless another process already is: then serves the stale value or waits for theirs"""
+    lock_key = key + ':lock'
+    lock_timeout = settings.COALESCE_LOCK_TIMEOUT
+
+    if not cache.add(lock_key, True, timeout=lock_timeout):
+        if entry is not None:
+            return entry['value']
+
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(settings.COALESCE_POLL_INTERVAL)
+            entry = cache.get(key)
+            if _is_fresh(entry, version):
+                return entry['value']
+            if not cache.add(lock_key, True, timeout=lock_timeout):
+                continue
+            # The other process is done or gave up, without a fresh value
+            break
+        else:
+            # Waited long enough; compute it here too
+            value = compute()
+            _store(cache, key, value, version, timeout, stale_timeout)
+            return value
+
+    try:
+        value = compute()
+        _store(cache, key, value, version, timeout, stale_timeout)
+        return value
+    finally:
+        cache.delete(lock_key)
+
+def coalesce(cache, key, compute, version=None, timeout=None, stale_timeout=0):
+    """
+    The value cached under key, calling compute() to refresh it when it is missing or stale
+    timeout is how long the value is fresh (None for as long as the version doesn't change)
+    """
+    entry = cache.get(key)
+    if _is_fresh(entry, version):
+        return entry['value']
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if entry is not None:
+            return entry['value']
+        return flight.wait()
+
+    try:
+        flight.value = _compute(cache, key, compute, version, timeout, stale_timeout, entry)
+        return flight.value
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
@@ -0,0 +1,110 @@
+"""
+Idempotency-Key support for writes that clients retry
+
+The first response for a user and key is kept in the IdempotencyKey table for IDEMPOTENCY_TIMEOUT seconds,
+and retries get it back without running the view again, whichever worker they reach.
+The key is reserved by inserting its row before running the view: the unique (user, key) constraint lets only
+one request win, so a concurrent duplicate gets a 409 instead of running it twice. Failed requests release the key,
+so that they can be retried. A reservation older than IDEMPOTENCY_LOCK_TIMEOUT, whose request must have died,
+can be taken over. `manage.py purge_idempotency_keys` deletes the expired rows.
+"""
+from datetime import timedelta
+from functools import wraps
+from hashlib import sha256
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+
+class IdempotencyConflict(APIException):
+    status_code = 409
+    default_detail = 'A request with this Idempotency-Key is still in progress'
+    default_code = 'idempotency_conflict'
+
+class IdempotencyKeyReused(APIException):
+    status_code = 422
+    default_detail = 'This Idempotency-Key was used for a different request'
+    default_code = 'idempotency_key_reused'
+
+def _fingerprint(request):
+    return sha256(b'\n'.join([
+        request.method.encode(),
+        request.get_full_path().encode(),
+        request._request.body,
+    ])).hexdigest()
+
+def _is_expired(record, now):
+    timeout = settings.IDEMPOTENCY_LOCK_TIMEOUT if record.status is None else settings.IDEMPOTENCY_TIMEOUT
+    return record.created < now - timedelta(seconds=timeout)
+
+def _reserve(user, key, fingerprint):
+    """
+    Reserves the key for a new request. Returns the reservation, or the existing row if the key is taken.
+    Expired rows are taken over with a conditional UPDATE, which only one request can win.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint, created=now), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is None:
+        # Released by a request that has just failed
+        raise IdempotencyConflict()
+    if _is_expired(record, now):
+        taken = IdempotencyKey.objects.filter(id=record.id, created=record.created).update(
+            fingerprint=fingerprint, status=None, response=None, created=now)
+        if taken == 0:
+            raise IdempotencyConflict()
+        record.fingerprint, record.status, record.response, record.created = fingerprint, None, None, now
+        return record, True
+    return record, False
+
+def purge_idempotency_keys():
+    """Deletes the keys whose response has expired, and the reservations of requests that died. Returns how many."""
+    now = timezone.now()
+    return IdempotencyKey.objects.filter(
+        Q(status__isnull=False, created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_TIMEOUT))
+        | Q(status__isnull=True, created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT))
+    ).delete()[0]
+
+def idempotent(handler):
+    """Decorates a view handler to replay its first response for repeated Idempotency-Key headers"""
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ParseError({'Idempotency-Key': 'At most 255 characters'})
+
+        fingerprint = _fingerprint(request)
+        record, reserved = _reserve(request.user, sha256(key.encode()).hexdigest(), fingerprint)
+
+        if reserved:
+            # Only this reservation: another request may have taken the key over since
+            reservation = IdempotencyKey.objects.filter(id=record.id, created=record.created)
+            try:
+                response = handler(view, request, *args, **kwargs)
+            except Exception:
+                reservation.delete()
+                raise
+            if response.status_code >= 400:
+                reservation.delete()
+            else:
+                reservation.update(status=response.status_code, response=response.data)
+            return response
+
+        if record.status is None:
+            raise IdempotencyConflict()
+        if record.fingerprint != fingerprint:
+            raise IdempotencyKeyReused()
+        return Response(record.response, status=record.status, headers={'Idempotent-Replayed': 'true'})
+
+    return wrapper
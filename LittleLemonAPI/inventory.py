@@ -0,0 +1,62 @@
+"""
+Stock levels of menu items
+
+Items with stock NULL are not tracked and never run out. Checkout takes the stock of every cart line
+in a single conditional UPDATE, without reading it first, so concurrent checkouts only wait on each other
+for the duration of that statement's transaction. If the order then can't be written, return_stock() gives it back.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from rest_framework.exceptions import APIException
+from .models import MenuItem
+
+
+class OutOfStock(APIException):
+    status_code = 409
+    default_detail = 'Not enough stock'
+    default_code = 'out_of_stock'
+
+def take_stock(lines):
+    """
+    Decrements the stock for the given (menuitem id, quantity) lines, each menu item appearing once
+    Must run in a transaction: raises OutOfStock, listing the short items, if any line can't be served
+    """
+    lines = list(lines)
+    condition = Q(pk__in=[])
+    whens = []
+    for (menuitem_id, quantity) in lines:
+        condition |= Q(id=menuitem_id) & (Q(stock__isnull=True) | Q(stock__gte=quantity))
+        whens.append(When(id=menuitem_id, then=F('stock') - quantity))
+
+    try:
+        with transaction.atomic():
+            updated = MenuItem.objects.filter(condition).update_unversioned(stock=Case(*whens))
+            if updated < len(lines):
+                # Undo the lines that were taken, to find out which ones are short
+                raise OutOfStock()
+    except OutOfStock:
+        quantities = dict(lines)
+        stock = MenuItem.objects.filter(id__in=quantities.keys()).values_list('id', 'stock')
+        short = [id for (id, available) in stock if available is not None and available < quantities[id]]
+        missing = set(quantities.keys()).difference(id for (id, available) in stock)
+        raise OutOfStock({'menuitem': sorted(short + list(missing))})
+
+    # Only items that just sold out change what the menu shows
+    sold_out = MenuItem.objects.filter(id__in=[id for (id, quantity) in lines], stock=0)
+    if sold_out.exists():
+        sold_out.update()
+
+def return_stock(lines):
+    """Gives back the stock taken by take_stock() for the given lines, e.g. when the order it was taken for failed"""
+    lines = list(lines)
+    whens = [When(id=menuitem_id, then=F('stock') + quantity) for (menuitem_id, quantity) in lines]
+    with transaction.atomic():
+        MenuItem.objects.filter(id__in=[id for (id, quantity) in lines], stock__isnull=False).update_unversioned(
+            stock=Case(*whens))
+        # Items that were sold out are available again
+        restocked = Q(pk__in=[])
+        for (menuitem_id, quantity) in lines:
+            restocked |= Q(id=menuitem_id, stock=quantity)
+        restocked = MenuItem.objects.filter(restocked)
+        if restocked.exists():
+            restocked.update()
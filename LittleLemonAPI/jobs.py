@@ -0,0 +1,109 @@
+"""
+Background jobs
+
+Views call enqueue() with a function (or its dotted path) and its JSON-serializable arguments, and return;
+`manage.py run_jobs` runs the jobs, highest priority first. A job enqueued inside a transaction only becomes
+visible to the workers once it commits.
+
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it. SQLite doesn't,
+and locks the whole database for writes anyway, so there a job is claimed with a conditional UPDATE
+from queued to running, which only one worker can win.
+
+Failed jobs are retried after JOBS_RETRY_BACKOFF seconds, doubling on every attempt, until max_attempts.
+Running jobs whose worker has held them longer than JOBS_LOCK_TIMEOUT are considered lost and queued again,
+or failed if they have no attempts left. A worker only records the result of a job it still holds.
+"""
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+
+def enqueue(func, *args, priority=0, max_attempts=None, delay=0, **kwargs):
+    """Queues func(*args, **kwargs) for a worker. Returns the Job."""
+    name = func if isinstance(func, str) else f'{func.__module__}.{func.__qualname__}'
+    return Job.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=priority,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+def _due_jobs():
+    return Job.objects.filter(status=Job.QUEUED, run_after__lte=timezone.now()).order_by('-priority', 'run_after', 'id')
+
+def _take(id, worker, **conditions):
+    return Job.objects.filter(id=id, **conditions).update(
+        status=Job.RUNNING,
+        locked_by=worker,
+        locked_at=timezone.now(),
+        attempts=F('attempts') + 1,
+    ) == 1
+
+def claim_job(worker):
+    """Takes the next due job for the given worker name, or returns None"""
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_due_jobs().select_for_update(skip_locked=True).values_list('id', flat=True)[:1])
+            if len(ids) == 0:
+                return None
+            _take(ids[0], worker)
+            return Job.objects.get(id=ids[0])
+
+    for id in _due_jobs().values_list('id', flat=True)[:settings.JOBS_CLAIM_CANDIDATES]:
+        if _take(id, worker, status=Job.QUEUED):
+            return Job.objects.get(id=id)
+    return None
+
+def run_job(job):
+    """Runs a claimed job, and records its result or schedules its retry"""
+    try:
+        import_string(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished = timezone.now()
+        else:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=settings.JOBS_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+    else:
+        job.status = Job.DONE
+        job.finished = timezone.now()
+        job.last_error = ''
+    # Lost and claimed again meanwhile: the result belongs to the new run
+    Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at).update(
+        status=job.status,
+        finished=job.finished,
+        run_after=job.run_after,
+        last_error=job.last_error,
+        locked_by='',
+        locked_at=None,
+    )
+
+def requeue_lost_jobs():
+    """
+    Queues again the running jobs whose worker seems to have died, and fails those without attempts left
+    Returns how many
+    """
+    now = timezone.now()
+    lost = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT))
+    failed = lost.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished=now, last_error='Lost by its worker', locked_by='', locked_at=None)
+    return failed + lost.update(status=Job.QUEUED, locked_by='', locked_at=None)
+
+def work(worker):
+    """Runs due jobs until there are none. Returns how many ran."""
+    count = 0
+    while True:
+        job = claim_job(worker)
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
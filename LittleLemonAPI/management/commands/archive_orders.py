@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from datetime import timedelta, date
+from ...archive import archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves old delivered orders to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive orders older than this many days (default: ORDER_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] is None:
+            before = archive_cutoff()
+        else:
+            before = date.today() - timedelta(days=options['days'])
+
+        count = archive_orders(before, batch_size=options['batch_size'])
+        self.stdout.write(f'Archived {count} orders dated before {before}')
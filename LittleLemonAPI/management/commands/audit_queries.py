@@ -0,0 +1,39 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from ...queryaudit import KINDS, audit, seed
+from ...sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = 'Runs every API route as every role against a seeded test database, and reports the query plans that scan tables, sort in temporary B-trees or lack an index, as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the report to this file instead of the standard output')
+        parser.add_argument('--fail-on', nargs='+', choices=KINDS, default=[], help='Exit with an error if any query is flagged with these kinds')
+        parser.add_argument('--items', type=int, default=200, help='Menu items to seed')
+        parser.add_argument('--customers', type=int, default=20, help='Customers to seed, with 10 orders each')
+
+    def handle(self, *args, **options):
+        aliases = set(['default'] + list(get_shards()))
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases=aliases)
+        try:
+            seeded = seed(items=options['items'], customers=options['customers'])
+            report = audit(seeded)
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        failed = {kind: report['summary'][kind] for kind in options['fail_on'] if report['summary'][kind] > 0}
+        if failed:
+            raise CommandError('Flagged queries: ' + ', '.join(f'{count} {kind}' for kind, count in failed.items()))
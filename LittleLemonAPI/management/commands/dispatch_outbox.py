@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from ...outbox import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Delivers order events from the outbox to OUTBOX_ENDPOINTS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver what is due and exit')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events per request')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds between polls')
+
+    def handle(self, *args, **options):
+        while True:
+            count = dispatch(batch_size=options['batch_size'])
+            if count > 0:
+                self.stdout.write(f'Delivered {count} events')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ...idempotency import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Deletes the Idempotency-Keys whose responses are no longer replayed'
+
+    def handle(self, *args, **options):
+        count = purge_idempotency_keys()
+        self.stdout.write(f'Deleted {count} expired idempotency keys')
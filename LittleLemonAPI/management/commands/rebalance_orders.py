@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from ...sharding import get_shards, rebalance_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves orders, carts and order events to the shard of their user, after a change of ORDER_SHARDS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drain', nargs='+', default=[], help='Databases removed from ORDER_SHARDS, to move everything out of')
+
+    def handle(self, *args, **options):
+        sources = get_shards() + [db for db in options['drain'] if db not in get_shards()]
+        count = rebalance_orders(sources)
+        self.stdout.write(f'Moved {count} users')
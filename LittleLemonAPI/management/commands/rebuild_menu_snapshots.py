@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from ...models import next_menu_version
+from ...snapshots import load_menu_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the pre-rendered menu snapshots, e.g. after importing menu items directly into the database'
+
+    def handle(self, *args, **options):
+        # Rows imported directly didn't allocate a version
+        next_menu_version()
+        snapshots = load_menu_snapshots()
+        self.stdout.write(f'Rendered {len(snapshots[None])} menu items in {len(snapshots) - 1} categories')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from ...stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-user order statistics from the orders (run once after installing them, or to fix drift)'
+
+    def handle(self, *args, **options):
+        count = rebuild_user_stats()
+        self.stdout.write(f'Rebuilt order statistics for {count} users')
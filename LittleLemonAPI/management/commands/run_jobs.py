@@ -0,0 +1,36 @@
+import os
+import socket
+import time
+from threading import Thread
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ...jobs import requeue_lost_jobs, work
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs queued with LittleLemonAPI.jobs.enqueue()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Jobs run at the same time, each in its own thread')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due and exit')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds between polls when the queue is empty')
+
+    def handle(self, *args, **options):
+        name = f'{socket.gethostname()}:{os.getpid()}'
+
+        def loop(worker):
+            try:
+                while True:
+                    requeue_lost_jobs()
+                    work(worker)
+                    if options['once']:
+                        return
+                    time.sleep(options['interval'])
+            finally:
+                connection.close()
+
+        threads = [Thread(target=loop, args=(f'{name}:{i}',)) for i in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
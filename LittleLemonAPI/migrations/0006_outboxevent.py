@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0005_menuitem_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.BigIntegerField()),
+                ('type', models.CharField(max_length=50)),
+                ('payload', models.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('delivered', models.DateTimeField(db_index=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+
+def allocate_existing_ids(apps, schema_editor):
+    """
+    Records the ids of the orders and outbox events so far, all in the default database, so that new ids come after them
+    """
+    connection = schema_editor.connection
+    if connection.alias != 'default':
+        return
+    GlobalId = apps.get_model('LittleLemonAPI', 'GlobalId')
+    users = {}
+    for model in ['Order', 'ArchivedOrder']:
+        users.update(apps.get_model('LittleLemonAPI', model).objects.values_list('id', 'user'))
+    for id in apps.get_model('LittleLemonAPI', 'OutboxEvent').objects.values_list('id', flat=True):
+        users.setdefault(id, None)
+    GlobalId.objects.bulk_create([GlobalId(id=id, user_id=user) for (id, user) in users.items()])
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [GlobalId]):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0008_userorderstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='delivery_crew',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='delivery_crew',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_crew', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='menuitem',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem'),
+        ),
+        migrations.CreateModel(
+            name='GlobalId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(allocate_existing_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:37
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_order_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuversion',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
@@ -1,10 +1,181 @@
-from django.db import models
+import uuid
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import F, Max
 from django.contrib.auth.models import User
 
 # Create your models here.
 
 
-class Category(models.Model):
+def next_menu_version():
+    """
+    Allocates the version of a new change to the menu
+    Callers write the changed rows in the same transaction. SQLite has one writer at a time, from the allocation
+    to the commit, so versions commit in order and a sync never skips a change committed after a later version
+    """
+    return MenuVersion.objects.create().id
+
+
+class MenuQuerySet(models.QuerySet):
+    """Bulk changes don't go through save() or delete(), so they version the rows here"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic():
+            version = next_menu_version()
+            for obj in objs:
+                obj.version = version
+            return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic():
+            version = next_menu_version()
+            for obj in objs:
+                obj.version = version
+            return super().bulk_update(objs, list(fields) + ['version'], *args, **kwargs)
+
+    def update(self, **kwargs):
+        with transaction.atomic():
+            return super().update(version=next_menu_version(), **kwargs)
+
+    def update_unversioned(self, **kwargs):
+        """update() for fields that neither the snapshots nor the delta sync show, like stock levels"""
+        return super().update(**kwargs)
+
+    def delete(self):
+        with transaction.atomic():
+            version = next_menu_version()
+            MenuTombstone.objects.bulk_create([
+                MenuTombstone(kind=self.model._meta.model_name, object_id=id, version=version)
+                for id in self.values_list('id', flat=True)
+            ])
+            return super().delete()
+
+
+class MenuModel(models.Model):
+    """
+    Models rendered in the menu snapshots and synced through /api/menu-items/changes
+    Each change stores a new version, which also marks the menu snapshots stale, and deletions leave a MenuTombstone
+    """
+    version = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    objects = MenuQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = next_menu_version()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + ['version']
+            return super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            MenuTombstone.objects.create(kind=self._meta.model_name, object_id=self.id, version=next_menu_version())
+            return super().delete(*args, **kwargs)
+
+
+# Order and outbox event ids are n * SHARD_ID_STRIDE + the number of the shard that allocated them
+SHARD_ID_STRIDE = 1024
+
+def allocate_ids(db, count):
+    """
+    Allocates count ids from the sequence of the shard db, unique across the shards. Returns the ids.
+    Only writes to that shard: the UPDATE is the first write of its transaction, so SQLite waits for the lock instead
+    of failing to upgrade it. Creating the sequence of a new shard is the only write to the default database.
+    """
+    with transaction.atomic(using=db):
+        sequences = IdSequence.objects.using(db)
+        if sequences.update(next=F('next') + count) == 0:
+            # Ids allocated by GlobalId before the sequences existed stay below the new ones
+            legacy = GlobalId.objects.aggregate(Max('id'))['id__max'] or 0
+            try:
+                with transaction.atomic(using=db):
+                    sequences.create(id=1, shard=ShardNumber.objects.create(alias=db).id,
+                        next=legacy // SHARD_ID_STRIDE + 1 + count)
+            except IntegrityError:
+                # Created by a concurrent allocation
+                return allocate_ids(db, count)
+        sequence = sequences.get()
+    first = sequence.next - count
+    return [(first + i) * SHARD_ID_STRIDE + sequence.shard for i in range(count)]
+
+def skip_ids(db, id):
+    """Moves the sequence of the shard db past the given id, e.g. of a row moved there from another shard"""
+    with transaction.atomic(using=db):
+        allocate_ids(db, 0)
+        IdSequence.objects.using(db).filter(next__lte=id // SHARD_ID_STRIDE).update(next=id // SHARD_ID_STRIDE + 1)
+
+
+class GlobalIdQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        new = [obj for obj in objs if obj.id is None]
+        ids = allocate_ids(self.db, len(new))
+        for obj, id in zip(new, ids):
+            obj.id = id
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class GlobalIdModel(models.Model):
+    """
+    Models kept in the order shards whose ids must be unique across them (see sharding.py)
+    New rows take their id from the IdSequence of their shard
+    """
+    objects = GlobalIdQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.id is None:
+            using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+            self.id = allocate_ids(using, 1)[0]
+            kwargs.setdefault('force_insert', True)
+        return super().save(*args, **kwargs)
+
+
+class IdSequence(models.Model):
+    """
+    The single row of a shard allocating the ids of its orders and outbox events (see allocate_ids)
+    shard is the number of the shard, from ShardNumber
+    """
+    shard = models.PositiveIntegerField()
+    next = models.BigIntegerField()
+
+
+class ShardNumber(models.Model):
+    """The number of each order shard, which the ids allocated by the shard end with. alias is only informative."""
+    alias = models.CharField(max_length=100)
+
+
+class GlobalId(models.Model):
+    """
+    Ids of orders and outbox events allocated in the default database, before the shards had their own IdSequence
+    Orders recorded their user
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
+
+
+class MenuVersion(models.Model):
+    """
+    One row per change to the menu. Its id is the version of the change.
+    The token tells apart versions that reuse the id of one rolled back, e.g. in the menu snapshot cache
+    """
+    token = models.UUIDField(default=uuid.uuid4, editable=False)
+
+
+class MenuTombstone(models.Model):
+    """A menu item or category deleted at the given version"""
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField(db_index=True)
+
+
+class Category(MenuModel):
     slug = models.SlugField()
     title = models.CharField(max_length=255, db_index=True)
 
@@ -16,23 +187,29 @@ class Category(models.Model):
         return self.title
 
 
-class MenuItem(models.Model):
+class MenuItem(MenuModel):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(default=False, db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    stock = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta():
         ordering = ['id']
 
     def __str__(self):
         return self.title
+
+    @property
+    def available(self):
+        """Items without stock tracking (stock is None) are always available"""
+        return self.stock is None or self.stock > 0
     
 
 class Cart(models.Model):
     """Each menu item currently in the user's cart."""
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -41,10 +218,14 @@ class Cart(models.Model):
         unique_together = ('user', 'menuitem')
 
 
-class Order(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+class Order(GlobalIdModel):
+    """
+    Orders, their items and carts are kept in the shard of their user (see sharding.py)
+    Their foreign keys to users and menu items have no database constraint, as those are in the default database
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     delivery_crew = models.ForeignKey(
-        User, on_delete=models.SET_NULL, related_name="delivery_crew", null=True)
+        User, on_delete=models.SET_NULL, related_name="delivery_crew", null=True, db_constraint=False)
     status = models.BooleanField(db_index=True, default=0)
     total = models.DecimalField(max_digits=6, decimal_places=2)
     date = models.DateField(db_index=True)
@@ -55,10 +236,110 @@ class Order(models.Model):
 class OrderItem(models.Model):
     """Each menu item in an order."""
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    class Meta():
+        unique_together = ('order', 'menuitem')
+
+
+class ArchivedOrder(models.Model):
+    """Delivered orders moved out of Order by the archive_orders command. Keeps the original id."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    delivery_crew = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name='+', null=True, db_constraint=False)
+    status = models.BooleanField(default=0)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateField(db_index=True)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta():
+        ordering = ['id']
+
+class ArchivedOrderItem(models.Model):
+    """Each menu item in an archived order."""
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
 
     class Meta():
         unique_together = ('order', 'menuitem')
+
+
+class OutboxEvent(GlobalIdModel):
+    """
+    An order event waiting to be delivered to OUTBOX_ENDPOINTS, written in the same transaction as the change
+    order is not a foreign key, so that events outlive archived orders
+    """
+    order = models.BigIntegerField()
+    type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    delivered = models.DateTimeField(null=True, db_index=True)
+
+    class Meta():
+        ordering = ['id']
+
+
+class Job(models.Model):
+    """Deferred work for the run_jobs worker, see jobs.py"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_after = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta():
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='job_claim_idx'),
+        ]
+
+
+class UserOrderStats(models.Model):
+    """Running totals of each user's orders, kept up to date by checkout and order updates (see stats.py)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='order_stats')
+    order_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_order_date = models.DateField(null=True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    A user's Idempotency-Key (hashed), reserved by the first request using it, then holding its response
+    status is None while that request runs
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(db_index=True)
+
+    class Meta():
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
@@ -0,0 +1,106 @@
+"""
+Transactional outbox for order events
+
+Views record events with record_order_events() inside the transaction that changes the orders, so an event
+exists if and only if the change was committed. The dispatch_outbox command then delivers them in batches,
+as a JSON POST of {"events": [...]} to every URL in OUTBOX_ENDPOINTS.
+
+Delivery is at least once: a batch is retried, with exponential backoff, until every endpoint accepts it,
+so endpoints should ignore event ids they have already seen. Events of an order are delivered in order:
+an event waits while an earlier one of the same order is undelivered. Run a single dispatcher.
+
+Events are kept in the shard of their order, and their ids are unique across shards.
+"""
+import json
+from collections import defaultdict
+from datetime import timedelta
+from urllib.request import Request, urlopen
+from django.conf import settings
+from django.utils import timezone
+from .models import OutboxEvent
+from .sharding import get_shards
+
+
+def _order_payload(order):
+    return {
+        'id': order.id,
+        'user': order.user_id,
+        'delivery_crew': order.delivery_crew_id,
+        'status': order.status,
+        'total': str(order.total),
+        'date': order.date.isoformat(),
+    }
+
+def record_order_events(type, orders):
+    """Records an event of the given type (e.g. order.created) for each order; call inside the change's transaction"""
+    events = defaultdict(list)
+    for order in orders:
+        events[order._state.db].append(OutboxEvent(order=order.id, type=type, payload=_order_payload(order)))
+    for db, shard_events in events.items():
+        OutboxEvent.objects.using(db).bulk_create(shard_events)
+
+def next_batch(size, using='default'):
+    """
+    The next events of the shard to deliver, oldest first
+    Skips the orders whose oldest undelivered event is waiting for a retry
+    """
+    now = timezone.now()
+    batch = []
+    blocked = set()
+    for event in OutboxEvent.objects.using(using).filter(delivered__isnull=True).order_by('id')[:size * 4]:
+        if event.order in blocked:
+            continue
+        if event.next_attempt is not None and event.next_attempt > now:
+            blocked.add(event.order)
+            continue
+        batch.append(event)
+        if len(batch) == size:
+            break
+    return batch
+
+def _post(url, events):
+    body = json.dumps({'events': [{
+        'id': event.id,
+        'type': event.type,
+        'order': event.order,
+        'created': event.created.isoformat(),
+        'payload': event.payload,
+    } for event in events]}).encode()
+    request = Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+    with urlopen(request, timeout=settings.OUTBOX_TIMEOUT) as response:
+        response.read()
+
+def deliver(events):
+    """
+    Sends the events, all from one shard, to every endpoint, and marks them delivered or schedules their retry
+    Returns whether the batch was delivered
+    """
+    events_of_shard = OutboxEvent.objects.using(events[0]._state.db)
+    try:
+        for url in settings.OUTBOX_ENDPOINTS:
+            _post(url, events)
+    except Exception as error:
+        for event in events:
+            event.attempts += 1
+            backoff = min(settings.OUTBOX_BACKOFF * 2 ** (event.attempts - 1), settings.OUTBOX_MAX_BACKOFF)
+            event.next_attempt = timezone.now() + timedelta(seconds=backoff)
+            event.last_error = str(error)
+        events_of_shard.bulk_update(events, ['attempts', 'next_attempt', 'last_error'])
+        return False
+
+    events_of_shard.filter(id__in=[event.id for event in events]).update(delivered=timezone.now(), last_error='')
+    return True
+
+def dispatch(batch_size=100):
+    """
+    Delivers the pending events of each shard, one batch after another, until none is due or a batch fails
+    Returns the number of events delivered
+    """
+    delivered = 0
+    for db in get_shards():
+        while True:
+            batch = next_batch(batch_size, using=db)
+            if len(batch) == 0 or not deliver(batch):
+                break
+            delivered += len(batch)
+    return delivered
@@ -0,0 +1,201 @@
+"""
+Query plan audit of the API
+
+audit() sends a set of requests (SCENARIOS) to every route of LittleLemonAPI/urls.py, as each role, captures the
+SQL they run and asks SQLite for the plan of each statement with EXPLAIN QUERY PLAN. Steps of the plans are flagged:
+
+- scan: reads a whole table ("SCAN table", not through an index)
+- temp_btree: sorts or groups rows in a temporary B-tree (ORDER BY or GROUP BY without a matching index)
+- missing_index: SQLite builds an automatic index for the query, because no index can serve a join or filter
+
+Requests that fail with a server error are listed under server_errors, since their plans don't show the route's.
+The database has no ANALYZE statistics, so plans only depend on the indexes available, not on the seeded row counts.
+Used by the audit_queries command, which runs it against a freshly seeded test database.
+"""
+import logging
+from contextlib import ExitStack
+from datetime import date, timedelta
+from django.contrib.auth.models import User, Group
+from django.core.cache import caches
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from .models import Category, MenuItem, Order, OrderItem
+from .sharding import get_shards, shard_for_user
+from . import urls
+
+ROLES = ['anonymous', 'customer', 'delivery', 'manager']
+
+# (route, method, query parameters or body); bodies and parameters can be functions of the seeded ids
+SCENARIOS = [
+    ('menu-items', 'GET', {}),
+    ('menu-items', 'GET', {'category': 'category-1'}),
+    ('menu-items', 'GET', {'search': 'item 1'}),
+    ('menu-items', 'GET', {'price_min': 5, 'price_max': 10}),
+    ('menu-items', 'GET', {'sort': 'price'}),
+    ('menu-items', 'GET', {'sort': 'title'}),
+    ('menu-items', 'GET', {'facets': 1}),
+    ('menu-items/<int:pk>', 'GET', {}),
+    ('menu-items/changes', 'GET', {'since': 1}),
+    ('groups/manager/users', 'GET', {}),
+    ('groups/manager/users/<int:pk>', 'GET', {}),
+    ('groups/delivery-crew/users', 'GET', {}),
+    ('groups/delivery-crew/users/<int:pk>', 'GET', {}),
+    ('cart/menu-items', 'POST', lambda seed: {'menuitem': seed['menuitem'], 'quantity': 1}),
+    ('cart/menu-items', 'GET', {}),
+    ('orders', 'POST', {}),
+    ('orders', 'GET', {}),
+    ('orders', 'GET', {'sort': '-total'}),
+    ('orders', 'GET', lambda seed: {'date_from': (date.today() - timedelta(days=30)).isoformat()}),
+    ('orders', 'PATCH', lambda seed: [{'id': seed['order'], 'status': True}]),
+    ('orders/summary', 'GET', {}),
+    ('orders/<int:pk>', 'GET', {}),
+    ('orders/<int:pk>', 'PATCH', {'status': True}),
+    ('batch', 'POST', {'requests': [{'path': '/api/menu-items'}, {'path': '/api/orders'}]}),
+]
+
+# Seeded object standing for <int:pk> in each route
+ROUTE_PKS = {
+    'menu-items/<int:pk>': 'menuitem',
+    'groups/manager/users/<int:pk>': 'manager',
+    'groups/delivery-crew/users/<int:pk>': 'delivery',
+    'orders/<int:pk>': 'order',
+}
+
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+KINDS = ['scan', 'temp_btree', 'missing_index']
+
+
+def seed(items=200, customers=20, orders_per_customer=10):
+    """Fills the database with a menu, a user per role and orders. Returns the ids used by the scenarios."""
+    manager = User.objects.create(username='audit-manager')
+    manager.groups.add(Group.objects.get_or_create(name='Manager')[0])
+    delivery = User.objects.create(username='audit-delivery')
+    delivery.groups.add(Group.objects.get_or_create(name='Delivery Crew')[0])
+    users = [User.objects.create(username=f'audit-customer-{i}') for i in range(customers)]
+
+    categories = Category.objects.bulk_create([Category(slug=f'category-{i}', title=f'Category {i}') for i in range(5)])
+    menuitems = MenuItem.objects.bulk_create([MenuItem(
+        title=f'Item {i}',
+        price=1 + i % 25,
+        featured=i % 10 == 0,
+        category=categories[i % len(categories)],
+        stock=None if i % 3 else 1000,
+    ) for i in range(items)])
+
+    today = date.today()
+    for user in users:
+        shard = shard_for_user(user.id)
+        orders = Order.objects.using(shard).bulk_create([Order(
+            user=user,
+            delivery_crew=delivery if i % 2 else None,
+            status=i % 4 == 0,
+            total=menuitems[i].price,
+            date=today - timedelta(days=i * 7),
+        ) for i in range(orders_per_customer)])
+        OrderItem.objects.using(shard).bulk_create([OrderItem(
+            order=order,
+            menuitem=menuitems[i],
+            quantity=1,
+            unit_price=menuitems[i].price,
+            price=menuitems[i].price,
+        ) for (i, order) in enumerate(orders)])
+
+    return {
+        'users': {'anonymous': None, 'customer': users[0], 'delivery': delivery, 'manager': manager},
+        'menuitem': menuitems[0].id,
+        'manager': manager.id,
+        'delivery': delivery.id,
+        'order': Order.objects.using(shard_for_user(users[0].id)).filter(user=users[0], delivery_crew=delivery).first().id,
+    }
+
+def explain(connection, sql):
+    """The EXPLAIN QUERY PLAN steps of a statement, and the flags they raise"""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        plan = [row[-1] for row in cursor.fetchall()]
+
+    flags = []
+    for step in plan:
+        if 'AUTOMATIC' in step:
+            flags.append({'kind': 'missing_index', 'detail': step})
+        elif step.startswith('SCAN ') and ' USING ' not in step:
+            # "SCAN table", or "SCAN TABLE table" before SQLite 3.36
+            words = step.split()
+            table = words[2] if words[1] == 'TABLE' else words[1]
+            if table not in ('CONSTANT', '(subquery') and not table.startswith('('):
+                flags.append({'kind': 'scan', 'table': table, 'detail': step})
+        elif step.startswith('USE TEMP B-TREE'):
+            flags.append({'kind': 'temp_btree', 'detail': step})
+    return plan, flags
+
+def _request(client, aliases, route, method, path, data):
+    """Sends one request, and returns its status and the flagged queries it ran"""
+    # Cached responses would hide the queries
+    for cache in caches.all():
+        cache.clear()
+
+    with ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases]
+        if method == 'GET':
+            response = client.get(path, data)
+        else:
+            response = getattr(client, method.lower())(path, data, format='json')
+
+    findings = []
+    count = 0
+    for alias, context in zip(aliases, contexts):
+        for query in context.captured_queries:
+            count += 1
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(EXPLAINED):
+                continue
+            plan, flags = explain(connections[alias], sql)
+            if flags:
+                findings.append({'database': alias, 'sql': sql, 'plan': plan, 'flags': flags})
+    return {'status': response.status_code, 'queries': count, 'findings': findings}
+
+def audit(seeded):
+    """Runs every scenario as every role and returns the report, as a JSON-serializable dict"""
+    aliases = sorted(set(['default'] + list(get_shards())))
+    for alias in aliases:
+        if connections[alias].vendor != 'sqlite':
+            raise ValueError(f'EXPLAIN QUERY PLAN needs SQLite, {alias} is {connections[alias].vendor}')
+
+    # Errors, like the 403s of the wrong roles, go to the report rather than the log
+    logger = logging.getLogger('django.request')
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    requests = []
+    try:
+        for role in ROLES:
+            client = APIClient(raise_request_exception=False)
+            if seeded['users'][role] is not None:
+                client.force_authenticate(user=seeded['users'][role])
+
+            for (route, method, data) in SCENARIOS:
+                if callable(data):
+                    data = data(seeded)
+                path = '/api/' + route.replace('<int:pk>', str(seeded.get(ROUTE_PKS.get(route), '')))
+                result = _request(client, aliases, route, method, path, data)
+                requests.append({'route': route, 'role': role, 'method': method, 'path': path, **result})
+    finally:
+        logger.setLevel(level)
+
+    routes = [str(pattern.pattern) for pattern in urls.urlpatterns]
+    exercised = set(request['route'] for request in requests)
+    # Their plans are those of a failed request, not of the route
+    errors = [{key: request[key] for key in ('route', 'role', 'method', 'path', 'status')}
+              for request in requests if request['status'] >= 500]
+    summary = {'requests': len(requests), 'queries': sum(request['queries'] for request in requests),
+               'server_errors': len(errors)}
+    for kind in KINDS:
+        summary[kind] = sum(1 for request in requests for finding in request['findings']
+                            for flag in finding['flags'] if flag['kind'] == kind)
+    return {
+        'summary': summary,
+        'routes_not_exercised': [route for route in routes if route not in exercised],
+        'server_errors': errors,
+        'requests': requests,
+    }
@@ -0,0 +1,67 @@
+from heapq import merge
+from itertools import islice
+
+
+class _Descending:
+    """Inverts the comparison of a sort key, for fields sorted with a leading '-'"""
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class MergedQuerySet:
+    """
+    Read-only list over several querysets of models with the same fields, merged in sort order
+    Supports what the paginator needs (count and slicing): each slice only loads the first rows of each queryset
+    """
+
+    def __init__(self, querysets, ordering):
+        self.ordering = list(ordering) or ['id']
+        if 'id' not in self.ordering and '-id' not in self.ordering:
+            self.ordering.append('id')
+        self.querysets = [queryset.order_by(*self.ordering) for queryset in querysets]
+        self.ordered = True
+
+    def _key(self, obj):
+        key = []
+        for field in self.ordering:
+            descending = field.startswith('-')
+            path = field.lstrip('-').split('__')
+            value = obj
+            for i, attr in enumerate(path):
+                if value is None:
+                    break
+                # A foreign key at the end of the path sorts by id, as in the database
+                model_field = value._meta.get_field(attr)
+                if model_field.many_to_one and i == len(path) - 1:
+                    attr = model_field.attname
+                value = getattr(value, attr)
+            # NULLs sort first, as in SQLite
+            value = (value is not None, value)
+            key.append(_Descending(value) if descending else value)
+        return key
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return merge(*self.querysets, key=self._key)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop
+        if stop is None:
+            parts = self.querysets
+        else:
+            parts = [queryset[:stop] for queryset in self.querysets]
+        return list(islice(merge(*parts, key=self._key), start, stop))
@@ -1,16 +1,32 @@
 from rest_framework import serializers
-from .models import MenuItem, Cart, Order, OrderItem
+from .models import Category, MenuItem, Cart, Order, OrderItem, UserOrderStats
 from django.contrib.auth.models import User
 
+class CategorySerializer(serializers.ModelSerializer):
+    class Meta():
+        model = Category
+        fields = ('id','slug','title')
+
 class MenuItemSerializer(serializers.ModelSerializer):
+    available = serializers.BooleanField(read_only=True)
     class Meta():
         model = MenuItem
-        fields = ('id','title','price','category','featured')
+        fields = ('id','title','price','category','featured','stock','available')
+        extra_kwargs = {
+            # Changes on every checkout, so it is kept out of the menu snapshots
+            'stock': {'write_only': True},
+        }
+
+class UserOrderStatsSerializer(serializers.ModelSerializer):
+    class Meta():
+        model = UserOrderStats
+        fields = ('order_count','delivered_count','lifetime_spend','last_order_date')
 
 class UserSerializer(serializers.ModelSerializer):
+    stats = UserOrderStatsSerializer(source='order_stats', read_only=True)
     class Meta():
         model = User
-        fields = ('id','username','email')
+        fields = ('id','username','email','stats')
 
 class CartItemSerializer(serializers.ModelSerializer):
     class Meta():
@@ -37,3 +53,23 @@ class OrderSerializer(serializers.ModelSerializer):
             'total': {'read_only': True},
             'date': {'read_only': True},
         }
+
+class GroupUsersSerializer(serializers.Serializer):
+    """Users added to or removed from a group: one `username`, or a `usernames` list"""
+    username = serializers.CharField(required=False)
+    usernames = serializers.ListField(child=serializers.CharField(), required=False)
+
+class OrderBulkUpdateSerializer(serializers.Serializer):
+    """One entry of a bulk order update. delivery_crew is a user id, checked by the view in a single query."""
+    id = serializers.IntegerField()
+    status = serializers.BooleanField(required=False)
+    delivery_crew = serializers.IntegerField(required=False, allow_null=True)
+
+class BatchItemSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET','POST','PUT','PATCH','DELETE'], default='GET')
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchItemSerializer(many=True)
+    parallel = serializers.BooleanField(default=False)
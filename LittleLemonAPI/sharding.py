@@ -0,0 +1,145 @@
+"""
+Sharding of the orders by user
+
+Orders, order items, carts, archived orders and outbox events are kept in the databases listed in ORDER_SHARDS,
+all the rows of a user in the same one (shard_for_user). Everything else stays in the default database.
+Order and outbox event ids are allocated by each shard (allocate_ids) and end with its number, so they are unique
+across shards without writing to the default database. locate_orders() finds the shard of an order from its id.
+
+Code reading or writing these models picks the database with using(): the user's shard for customers and carts,
+every shard for the lists of managers and delivery crew. OrderShardRouter keeps the other models in the default
+database and follows relations (order.items, item.menuitem, ...) to the database of the related row.
+Writes to a shard and to the default database (stock, statistics) are separate short transactions, never nested:
+the stock is taken before the order is written, and given back if that fails; the statistics are updated once it has
+committed. A request holds the lock of at most one database, except the bulk update of orders, which locks the shards
+in the order of ORDER_SHARDS.
+
+After changing ORDER_SHARDS, run `manage.py rebalance_orders` to move the users whose shard changed.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, Cart, OutboxEvent, skip_ids
+
+SHARDED_MODELS = {'order', 'orderitem', 'cart', 'archivedorder', 'archivedorderitem', 'outboxevent', 'idsequence'}
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'LittleLemonAPI' and model._meta.model_name in SHARDED_MODELS
+
+def get_shards():
+    return settings.ORDER_SHARDS
+
+def shard_for_user(user_id):
+    shards = get_shards()
+    return shards[user_id % len(shards)]
+
+def locate_orders(ids):
+    """
+    {shard: [order ids]} for the given order (or archived order) ids, in one query per shard, in the order of
+    ORDER_SHARDS. Unknown ids are left out.
+    """
+    shards = {}
+    for db in get_shards():
+        found = Order.objects.using(db).order_by().filter(id__in=ids).values_list('id', flat=True).union(
+            ArchivedOrder.objects.using(db).order_by().filter(id__in=ids).values_list('id', flat=True))
+        found = list(found)
+        if len(found) > 0:
+            shards[db] = found
+    return shards
+
+
+class OrderShardRouter:
+    """Routes the sharded models to the database of related rows, and everything else to the default database"""
+
+    def _db(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if is_sharded(type(instance)):
+            return instance._state.db
+        if instance._meta.label == settings.AUTH_USER_MODEL and instance.pk is not None:
+            return shard_for_user(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is None:
+            return None
+        # Sharded tables are created everywhere, so that any database can be added to ORDER_SHARDS
+        if app_label == 'LittleLemonAPI' and model_name in SHARDED_MODELS:
+            return True
+        return db == DEFAULT_DB_ALIAS
+
+
+def rebalance_orders(sources=None):
+    """
+    Moves the rows of every user to their shard, after a change of ORDER_SHARDS
+    sources are the databases to move rows out of: the shards by default, plus any database removed from ORDER_SHARDS
+    Returns the number of users moved
+    """
+    moved = 0
+    for source in sources or get_shards():
+        users = set()
+        for model in [Order, ArchivedOrder, Cart]:
+            users.update(model.objects.using(source).order_by().values_list('user', flat=True).distinct())
+        for user in sorted(users):
+            target = shard_for_user(user)
+            if target != source:
+                _move_user(user, source, target)
+                moved += 1
+    return moved
+
+def _copy(model, rows, target):
+    """Copies rows to the target keeping their ids, skipping those already there. Returns the ids copied."""
+    existing = set(model.objects.using(target).filter(id__in=[row.id for row in rows]).values_list('id', flat=True))
+    rows = [row for row in rows if row.id not in existing]
+    model.objects.using(target).bulk_create(rows)
+    return [row.id for row in rows]
+
+def _move_user(user, source, target):
+    """
+    Moves a user's rows, copying them in a transaction of the target, then deleting them in one of the source
+    The transactions aren't nested, so that no lock is held while waiting for another: if the deletion fails,
+    the next run finds the copies and only deletes
+    """
+    with transaction.atomic(using=target):
+        ids = []
+        for (model, item_model) in [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]:
+            orders = list(model.objects.using(source).filter(user=user))
+            copied = _copy(model, orders, target)
+            items = list(item_model.objects.using(source).filter(order__in=copied))
+            for item in items:
+                # Item ids are only unique within a shard
+                item.id = None
+            item_model.objects.using(target).bulk_create(items)
+            ids.extend(order.id for order in orders)
+
+        events = list(OutboxEvent.objects.using(source).filter(order__in=ids))
+        _copy(OutboxEvent, events, target)
+        # Events written in the target from now on come after the moved ones
+        if len(events) > 0:
+            skip_ids(target, max(event.id for event in events))
+
+        lines = list(Cart.objects.using(source).filter(user=user))
+        for line in lines:
+            line.id = None
+        # Lines added in the new shard since the change win
+        Cart.objects.using(target).bulk_create(lines, ignore_conflicts=True)
+
+    with transaction.atomic(using=source):
+        for model in [Order, ArchivedOrder, Cart]:
+            model.objects.using(source).filter(user=user).delete()
+        OutboxEvent.objects.using(source).filter(order__in=ids).delete()
@@ -0,0 +1,52 @@
+"""
+Pre-rendered menu snapshots
+
+The menu only changes when an item or category is edited, so the JSON of every menu item is rendered once
+and kept in the cache, grouped by category slug. MenuItemsView serves unfiltered and category-only lists
+from it, only assembling the page around the pre-rendered items.
+
+Any change to MenuItem or Category adds a MenuVersion row (see models.py). Snapshots are cached for the latest
+one, read from the database with a single primary key lookup, so every worker sees a change on its next request
+and rebuilds the snapshot; concurrent requests get the previous one meanwhile (see coalescing.py).
+MENU_SNAPSHOT_CACHE should be shared by the workers, so that they render the menu once between them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from .coalescing import coalesce
+from .models import MenuItem, MenuVersion
+
+SNAPSHOT_KEY = 'menu-snapshot'
+
+
+def _cache():
+    return caches[settings.MENU_SNAPSHOT_CACHE]
+
+def get_menu_version():
+    """Changes whenever the menu does, and never repeats: the id and token of the latest MenuVersion"""
+    latest = MenuVersion.objects.order_by('-id').values_list('id', 'token').first()
+    return '{}:{}'.format(*latest) if latest else ''
+
+def build_menu_snapshots():
+    """
+    Renders every menu item to JSON
+    Returns a dict of lists of rendered items: the full menu under None, and each category under its slug
+    """
+    from rest_framework.renderers import JSONRenderer
+    from .serializers import MenuItemSerializer
+
+    items = list(MenuItem.objects.select_related('category'))
+    renderer = JSONRenderer()
+    snapshots = {None: []}
+    for item, data in zip(items, MenuItemSerializer(items, many=True).data):
+        rendered = renderer.render(data)
+        snapshots[None].append(rendered)
+        snapshots.setdefault(item.category.slug, []).append(rendered)
+    return snapshots
+
+def load_menu_snapshots():
+    """The snapshots for the current menu version, building them if needed"""
+    return coalesce(_cache(), SNAPSHOT_KEY, build_menu_snapshots, version=get_menu_version())
+
+def get_menu_snapshot(category=None):
+    """Rendered menu items, for a category slug or the full menu"""
+    return load_menu_snapshots().get(category, [])
@@ -0,0 +1,93 @@
+"""
+Per-user order statistics
+
+UserOrderStats is updated with F() increments once the transactions that create orders or change their status
+have committed, so reading a user's totals never scans Order. Those are in the order shards: the statistics, in the
+default database, are written by a short transaction of their own (see sharding.py).
+rebuild_user_stats() recomputes them from the orders, including archived ones, for the rebuild_order_stats command.
+"""
+from collections import Counter, defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from .models import Order, ArchivedOrder, UserOrderStats
+from .sharding import get_shards
+
+
+def record_order(order):
+    """Adds a new order to its user's totals"""
+    updated = UserOrderStats.objects.filter(user=order.user_id).update(
+        order_count=F('order_count') + 1,
+        delivered_count=F('delivered_count') + (1 if order.status else 0),
+        lifetime_spend=F('lifetime_spend') + order.total,
+        last_order_date=order.date,
+    )
+    if updated == 0:
+        try:
+            with transaction.atomic():
+                UserOrderStats.objects.create(
+                    user_id=order.user_id,
+                    order_count=1,
+                    delivered_count=1 if order.status else 0,
+                    lifetime_spend=order.total,
+                    last_order_date=order.date,
+                )
+        except IntegrityError:
+            # Created by a concurrent checkout of the same user
+            record_order(order)
+
+def record_deliveries(changes):
+    """
+    Updates the delivered counts for orders whose status changed
+    changes is a list of (user id, new status), one per changed order
+    """
+    deltas = Counter()
+    for (user_id, status) in changes:
+        deltas[user_id] += 1 if status else -1
+    with transaction.atomic():
+        for user_id, delta in deltas.items():
+            if delta != 0:
+                UserOrderStats.objects.filter(user=user_id).update(delivered_count=F('delivered_count') + delta)
+
+def update_status(db, orders, status):
+    """
+    Sets the status of the given orders of a shard, a list of (order id, user id)
+    Returns the changes to pass to record_deliveries() once the shard's transaction has committed
+    Each user's orders are changed by one conditional UPDATE, and only the rows it changes are counted: a status read
+    before, even in the same request, may have been changed since by a concurrent one
+    Call it before any read in the transaction, so that SQLite waits for the write lock instead of failing to upgrade
+    """
+    users = defaultdict(list)
+    for (id, user_id) in orders:
+        users[user_id].append(id)
+    changes = []
+    for user_id, ids in users.items():
+        changed = Order.objects.using(db).filter(id__in=ids).exclude(status=status).update(status=status)
+        changes.extend([(user_id, status)] * changed)
+    return changes
+
+def rebuild_user_stats():
+    """
+    Recomputes every user's totals from their orders. Returns the number of users with orders.
+    The old rows are deleted before reading the orders, which takes the write lock on the default database:
+    updates of the totals wait until the new ones are written, instead of being lost when they replace them.
+    With several shards, an order committed while the rebuild reads its shard may still be counted twice.
+    """
+    stats = {}
+    with transaction.atomic():
+        UserOrderStats.objects.all().delete()
+        for (db, model) in [(db, model) for db in get_shards() for model in [Order, ArchivedOrder]]:
+            totals = model.objects.using(db).order_by().values('user').annotate(
+                order_count=Count('id'),
+                delivered_count=Count('id', filter=Q(status=True)),
+                lifetime_spend=Sum('total'),
+                last_order_date=Max('date'),
+            )
+            for row in totals:
+                user_stats = stats.setdefault(row['user'], UserOrderStats(user_id=row['user'], lifetime_spend=0))
+                user_stats.order_count += row['order_count']
+                user_stats.delivered_count += row['delivered_count']
+                user_stats.lifetime_spend += row['lifetime_spend']
+                if user_stats.last_order_date is None or row['last_order_date'] > user_stats.last_order_date:
+                    user_stats.last_order_date = row['last_order_date']
+        UserOrderStats.objects.bulk_create(stats.values())
+    return len(stats)
@@ -0,0 +1,195 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User, Group
+from ..admin import EstimatedCountPaginator
+from ..models import Category, MenuItem, Cart, Order, OrderItem, OutboxEvent, UserOrderStats
+from datetime import date
+
+ORDERS_URL = reverse('admin:LittleLemonAPI_order_changelist')
+SHARDS = ['default', 'orders_1']
+
+class AdminTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.crew = User.objects.create(username='crew')
+        self.crew.groups.add(Group.objects.create(name='Delivery Crew'))
+        self.customers = [User.objects.create(username=f'customer{i}') for i in range(3)]
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        self.orders = []
+        for customer in self.customers:
+            order = Order.objects.create(user=customer, total=2, date=date.today())
+            OrderItem.objects.create(order=order, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+            Cart.objects.create(user=customer, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+            self.orders.append(order)
+        UserOrderStats.objects.bulk_create([UserOrderStats(user=customer, order_count=1) for customer in self.customers])
+
+        self.client.force_login(self.admin)
+        return super().setUp()
+
+    def test_changelists(self):
+        """
+        Changelists load the related rows in the same query, whatever the number of rows
+        """
+        urls = [reverse(f'admin:LittleLemonAPI_{model}_changelist') for model in ['order', 'orderitem', 'cart', 'menuitem']]
+        counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+            counts.append(len(context.captured_queries))
+
+        for customer in self.customers:
+            order = Order.objects.create(user=customer, delivery_crew=self.crew, total=2, date=date.today())
+            OrderItem.objects.create(order=order, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+        for url, count in zip(urls, counts):
+            with self.assertNumQueries(count):
+                self.client.get(url)
+
+
+    def test_search(self):
+        """
+        Orders are found by exact username, or by id
+        """
+        response = self.client.get(ORDERS_URL, {'q': 'customer1'})
+        self.assertEqual([order.id for order in response.context['cl'].result_list], [self.orders[1].id])
+        response = self.client.get(ORDERS_URL, {'q': str(self.orders[2].id)})
+        self.assertEqual([order.id for order in response.context['cl'].result_list], [self.orders[2].id])
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_count(self):
+        """
+        Beyond the limit, counting stops at the limit, unless the database has statistics for unfiltered lists
+        """
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status=False), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(user=self.customers[0]), 10).count, 1)
+
+        # Without statistics, unfiltered lists are estimated from the range of their ids
+        for customer in self.customers:
+            Order.objects.create(user=customer, total=2, date=date.today())
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status=False), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 10).count, 6)
+        self.assertEqual(EstimatedCountPaginator(MenuItem.objects.all(), 10).count, 1)
+
+    def test_actions(self):
+        """
+        WHEN orders are marked delivered or assigned from the changelist
+        THEN they are updated together
+        AND the statistics and the outbox follow
+        """
+        ids = [self.orders[0].id, self.orders[1].id]
+        response = self.client.post(ORDERS_URL, {'action': 'mark_delivered', '_selected_action': ids})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(Order.objects.filter(status=True).values_list('id', flat=True)), ids)
+        self.assertEqual(UserOrderStats.objects.get(user=self.customers[0]).delivered_count, 1)
+        self.assertEqual(OutboxEvent.objects.filter(type='order.updated').count(), 2)
+
+        self.client.post(ORDERS_URL, {'action': 'assign_delivery_crew', '_selected_action': ids, 'delivery_crew': self.crew.id})
+        self.assertEqual(Order.objects.filter(delivery_crew=self.crew).count(), 2)
+
+        # Without a crew member nothing changes
+        self.client.post(ORDERS_URL, {'action': 'assign_delivery_crew', '_selected_action': [self.orders[2].id]})
+        self.assertIsNone(Order.objects.get(id=self.orders[2].id).delivery_crew)
+
+    def test_change_form(self):
+        """
+        WHEN an order's status is changed from its change form
+        THEN the statistics and the outbox follow, like with the actions
+        AND orders can't be added or deleted, nor their items changed, from the admin
+        """
+        order = self.orders[0]
+        url = reverse('admin:LittleLemonAPI_order_change', args=[order.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.forms), 1)
+        data = {'status': 'on', 'delivery_crew': self.crew.id}
+        for formset in response.context['inline_admin_formsets']:
+            management = formset.formset.management_form
+            data.update({management.add_prefix(name): value for name, value in management.initial.items()})
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+        order.refresh_from_db()
+        self.assertTrue(order.status)
+        self.assertEqual(order.delivery_crew, self.crew)
+        self.assertEqual(UserOrderStats.objects.get(user=self.customers[0]).delivered_count, 1)
+        self.assertEqual(OutboxEvent.objects.filter(type='order.updated', order=order.id).count(), 1)
+
+        self.assertEqual(self.client.get(reverse('admin:LittleLemonAPI_order_add')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:LittleLemonAPI_order_delete', args=[order.id])).status_code, 403)
+        response = self.client.get(ORDERS_URL)
+        self.assertNotIn('delete_selected', dict(response.context['action_form'].fields['action'].choices))
+        self.assertEqual(self.client.get(reverse('admin:LittleLemonAPI_orderitem_add')).status_code, 403)
+
+
+@override_settings(ORDER_SHARDS=SHARDS)
+class AdminShardsTest(APITestCase):
+    databases = {'default', 'orders_1'}
+
+    def setUp(self) -> None:
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.crew = User.objects.create(username='crew')
+        self.crew.groups.add(Group.objects.create(name='Delivery Crew'))
+        self.customers = [User.objects.create(username=f'customer{i}') for i in range(4)]
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        self.orders = {db: [] for db in SHARDS}
+        for customer in self.customers:
+            shard = SHARDS[customer.id % 2]
+            order = Order.objects.using(shard).create(user=customer, total=2, date=date.today())
+            OrderItem.objects.using(shard).create(order=order, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+            Cart.objects.using(shard).create(user=customer, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+            self.orders[shard].append(order)
+        self.client.force_login(self.admin)
+        return super().setUp()
+
+    def test_changelists(self):
+        """
+        Changelists show the shard picked by the shard filter, the first one by default
+        """
+        response = self.client.get(ORDERS_URL)
+        self.assertEqual([order.id for order in response.context['cl'].result_list],
+            [order.id for order in reversed(self.orders['default'])])
+        response = self.client.get(ORDERS_URL, {'shard': 'orders_1'})
+        self.assertEqual([order.id for order in response.context['cl'].result_list],
+            [order.id for order in reversed(self.orders['orders_1'])])
+        self.assertContains(response, '?shard=default')
+
+        for model in ['orderitem', 'cart']:
+            response = self.client.get(reverse(f'admin:LittleLemonAPI_{model}_changelist'), {'shard': 'orders_1'})
+            self.assertEqual(len(response.context['cl'].result_list), 2)
+
+    def test_search(self):
+        """
+        Searches by username find the users in the default database
+        """
+        customer = [customer for customer in self.customers if customer.id % 2 == 1][0]
+        response = self.client.get(ORDERS_URL, {'shard': 'orders_1', 'q': customer.username})
+        self.assertEqual([order.user for order in response.context['cl'].result_list], [customer])
+
+    def test_change(self):
+        """
+        Orders of another shard are changed from their change form or the actions, in their shard
+        """
+        order = self.orders['orders_1'][0]
+        url = reverse('admin:LittleLemonAPI_order_change', args=[order.id]) + '?_changelist_filters=shard%3Dorders_1'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.forms), 1)
+        data = {'status': 'on', 'delivery_crew': self.crew.id}
+        for formset in response.context['inline_admin_formsets']:
+            management = formset.formset.management_form
+            data.update({management.add_prefix(name): value for name, value in management.initial.items()})
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        order = Order.objects.using('orders_1').get(id=order.id)
+        self.assertTrue(order.status)
+        self.assertEqual(order.delivery_crew, self.crew)
+
+        order = self.orders['orders_1'][1]
+        self.client.post(ORDERS_URL + '?shard=orders_1', {'action': 'mark_delivered', '_selected_action': [order.id]})
+        self.assertTrue(Order.objects.using('orders_1').get(id=order.id).status)
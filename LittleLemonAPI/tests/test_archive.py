@@ -0,0 +1,131 @@
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User, Group
+from ..models import Category, MenuItem, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from datetime import date, timedelta
+from io import StringIO
+
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    )
+
+LIST_URL = reverse('orders_list')
+def DETAIL_URL(pk): return reverse('orders_detail', kwargs={'pk':pk})
+
+class ArchiveTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+        self.customer2 = User.objects.create(username='customer2')
+        self.manager = User.objects.create(username='manager')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+
+        category = Category.objects.create(title='appetizer')
+        MenuItem.objects.bulk_create([
+            MenuItem(title='bread',price=2, category=category),
+            MenuItem(title='cake',price=3, category=category),
+        ])
+        self.menuitems = MenuItem.objects.all()
+
+        self.today = date.today()
+        self.old = self.today - timedelta(days=200)
+
+        self.recent_order = self._createOrder(user=self.customer, date=self.today, status=True)
+        self.old_order = self._createOrder(user=self.customer, date=self.old, status=True)
+        self.old_pending = self._createOrder(user=self.customer, date=self.old)
+        self.other_order = self._createOrder(user=self.customer2, date=self.old, status=True)
+
+        return super().setUp()
+
+    def _createOrder(self, **kwargs):
+        order = Order.objects.create(total=5, **kwargs)
+        OrderItem.objects.bulk_create(map(lambda item:OrderItem(
+            order=order, 
+            menuitem=item, 
+            quantity=1, 
+            unit_price=item.price,
+            price=item.price,
+            ), self.menuitems))
+        return order
+
+    def _archive(self):
+        call_command('archive_orders', '--batch-size', '1', stdout=StringIO())
+
+    def test_archive_command(self):
+        """
+        Only old delivered orders are moved, with their items
+        """
+        self._archive()
+
+        self.assertSetEqual(
+            set(Order.objects.values_list('id', flat=True)),
+            set([self.recent_order.id, self.old_pending.id]))
+        self.assertSetEqual(
+            set(ArchivedOrder.objects.values_list('id', flat=True)),
+            set([self.old_order.id, self.other_order.id]))
+        self.assertEqual(ArchivedOrderItem.objects.filter(order=self.old_order.id).count(), 2)
+        self.assertEqual(OrderItem.objects.filter(order=self.old_order.id).count(), 0)
+
+        # Running again has nothing left to do
+        self._archive()
+        self.assertEqual(ArchivedOrder.objects.count(), 2)
+
+    def test_list(self):
+        """
+        Archived orders are only listed when a date filter reaches into the archive
+        """
+        self._archive()
+        self.client.force_authenticate(user=self.customer)
+
+        cases = [
+            ('', [self.recent_order, self.old_pending]),
+            (f'?date_from={self.today}', [self.recent_order]),
+            (f'?date_from={self.old}', [self.recent_order, self.old_order, self.old_pending]),
+            (f'?date_to={self.old}&sort=-id', [self.old_pending, self.old_order]),
+        ]
+        for (params, expected) in cases:
+            response = self.client.get(LIST_URL + params)
+            self.assertEqual(response.status_code, HTTP_200_OK, f"with params: {params}")
+            actual = [x.get('id') for x in response.data.get('results')]
+            self.assertListEqual(actual, [order.id for order in expected], f"with params: {params}")
+
+        response = self.client.get(LIST_URL + f'?date_from={self.old}')
+        archived = [x for x in response.data.get('results') if x.get('id') == self.old_order.id][0]
+        self.assertEqual(len(archived.get('items')), 2)
+
+        response = self.client.get(LIST_URL + '?date_from=yesterday')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_manager_list(self):
+        """
+        Managers see every archived order, merged in sort order
+        """
+        self._archive()
+        self.client.force_authenticate(user=self.manager)
+
+        response = self.client.get(LIST_URL + f'?date_from={self.old}&sort=-date,id')
+        self.assertEqual(response.data.get('count'), 4)
+        actual = [x.get('id') for x in response.data.get('results')]
+        expected = [self.recent_order.id, self.old_order.id, self.old_pending.id, self.other_order.id]
+        self.assertListEqual(actual, expected)
+
+    def test_retrieve(self):
+        """
+        Archived orders can be retrieved by their owner, but not modified
+        """
+        self._archive()
+
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.get(DETAIL_URL(self.old_order.id))
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data.get('id'), self.old_order.id)
+
+        response = self.client.get(DETAIL_URL(self.other_order.id))
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.manager)
+        response = self.client.patch(DETAIL_URL(self.old_order.id), {'status':0})
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
@@ -0,0 +1,113 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+from django.contrib.auth.models import User
+from ..models import Category, MenuItem, Cart
+
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+    HTTP_500_INTERNAL_SERVER_ERROR,
+    )
+
+URL = reverse('batch')
+
+class BatchTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+
+        category = Category.objects.create(title='appetizer')
+        MenuItem.objects.bulk_create([
+            MenuItem(title='bread',price=2, category=category),
+            MenuItem(title='cake',price=3, category=category),
+        ])
+        self.menuitems = MenuItem.objects.all()
+
+        return super().setUp()
+
+    def test_batch(self):
+        """
+        WHEN user POSTs a batch
+        THEN each sub-request is run in order, as the current user
+        AND each response is returned in order
+        """
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(URL, {'requests':[
+            {'path':'/api/menu-items?sort=-price'},
+            {'method':'POST', 'path':'/api/cart/menu-items', 'body':{'menuitem':self.menuitems[0].id, 'quantity':2}},
+            {'path':'/api/cart/menu-items'},
+            {'path':'/api/nothing-here'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        results = response.data
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]['status'], HTTP_200_OK)
+        self.assertEqual([x['title'] for x in results[0]['body']['results']], ['cake','bread'])
+        self.assertEqual(results[1]['status'], HTTP_201_CREATED)
+        self.assertEqual(results[2]['status'], HTTP_200_OK)
+        self.assertEqual(len(results[2]['body']), 1)
+        self.assertEqual(results[3]['status'], HTTP_404_NOT_FOUND)
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 1)
+
+    def test_anonymous(self):
+        """
+        Anonymous sub-requests are subject to the permissions of each view
+        """
+        response = self.client.post(URL, {'requests':[
+            {'path':'/api/menu-items'},
+            {'method':'POST', 'path':'/api/menu-items', 'body':{'title':'soup'}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data[0]['status'], HTTP_200_OK)
+        self.assertEqual(response.data[1]['status'], HTTP_401_UNAUTHORIZED)
+
+    def test_server_error(self):
+        """
+        WHEN a sub-request fails with an unexpected error
+        THEN only its entry has a 500 status
+        AND the other sub-requests still run
+        """
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(URL, {'requests':[
+            {'path':'/api/orders?sort=nothing'},
+            {'path':'/api/menu-items'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data[0]['status'], HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.data[1]['status'], HTTP_200_OK)
+
+    def test_limits(self):
+        """
+        Batches cannot be nested, nor exceed the maximum number of requests
+        """
+        response = self.client.post(URL, {'requests':[{'method':'POST', 'path':URL, 'body':{'requests':[]}}]}, format='json')
+        self.assertEqual(response.data[0]['status'], HTTP_400_BAD_REQUEST)
+
+        # Only API paths
+        response = self.client.post(URL, {'requests':[{'path':'/admin/'}, {'path':'/auth/users/'}]}, format='json')
+        self.assertEqual([x['status'] for x in response.data], [HTTP_400_BAD_REQUEST] * 2)
+
+        with self.settings(BATCH_MAX_REQUESTS=1):
+            response = self.client.post(URL, {'requests':[{'path':'/api/menu-items'}] * 2}, format='json')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+class ParallelBatchTest(APITransactionTestCase):
+
+    def test_parallel(self):
+        """
+        Read-only batches can run concurrently, and responses keep the order of the requests
+        """
+        category = Category.objects.create(title='appetizer')
+        MenuItem.objects.create(title='bread',price=2, category=category)
+
+        response = self.client.post(URL, {'parallel':True, 'requests':[
+            {'path':'/api/menu-items'},
+            {'path':'/api/menu-items?search=nothing'},
+            {'path':'/api/menu-items?search=bread'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([x['body']['count'] for x in response.data], [1, 0, 1])
@@ -1,8 +1,12 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User
-from ..models import Category, MenuItem, Cart
+from ..checks import check_cart_cache
+from ..models import Category, MenuItem, Cart, Order
 from ..serializers import CartItemSerializer
 
 URL = '/api/cart/menu-items'
@@ -48,6 +52,16 @@ class CartTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, serializer.data)
 
+    def test_anonymous(self):
+        """
+        WHEN an anonymous user GETs the cart
+        THEN it is empty
+        """
+        Cart.objects.bulk_create([self._newCart(self.carl, self.menuitems[0], 1)])
+        response = self.client.get(URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
     def test_create_record(self):
         """
         WHEN user POSTs a new cart item
@@ -116,3 +130,83 @@ class CartTest(APITestCase):
         self.assertEqual(carts_in_db.__len__(), 3)
         for cart in carts_in_db:
             self.assertEqual(cart.user, self.cole)
+
+@override_settings(CART_STORE='LittleLemonAPI.carts.CacheCartStore', CART_MAX_ITEMS=2)
+class CacheCartTest(APITestCase):
+
+    def setUp(self) -> None:
+        caches[settings.CART_CACHE].clear()
+        self.carl = User.objects.create(username='carl', password='password')
+        self.cole = User.objects.create(username='cole', password='password')
+
+        category = Category.objects.create(title='appetizer')
+        MenuItem.objects.bulk_create([
+            MenuItem(title='chips', category=category, price=1),
+            MenuItem(title='meat', category=category, price=2),
+            MenuItem(title='icecream', category=category, price=3),
+        ])
+        self.menuitems = MenuItem.objects.all()
+
+    def test_cart(self):
+        """
+        WHEN the cart is kept in the cache
+        THEN adding, updating and removing items never writes Cart records
+        """
+        self.client.force_authenticate(user=self.carl)
+        response = self.client.post(URL, {'menuitem':self.menuitems[1].id, 'quantity':3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'menuitem':self.menuitems[1].id, 'quantity':3, 'unit_price':'2.00', 'price':'6.00'})
+
+        self.client.post(URL, {'menuitem':self.menuitems[0].id, 'quantity':1})
+        self.client.post(URL, {'menuitem':self.menuitems[1].id, 'quantity':2})
+        response = self.client.get(URL)
+        self.assertEqual([(x['menuitem'], x['quantity'], x['price']) for x in response.data], [
+            (self.menuitems[0].id, 1, '1.00'),
+            (self.menuitems[1].id, 2, '4.00'),
+        ])
+
+        self.client.post(URL, {'menuitem':self.menuitems[0].id, 'quantity':0})
+        response = self.client.get(URL)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(Cart.objects.count(), 0)
+
+        self.client.force_authenticate(user=self.cole)
+        self.assertEqual(self.client.get(URL).data, [])
+
+        self.client.force_authenticate(user=self.carl)
+        self.client.delete(URL)
+        self.assertEqual(self.client.get(URL).data, [])
+
+    def test_private_cache(self):
+        """
+        The system checks reject a cart cache that each worker keeps to itself
+        """
+        self.assertEqual(check_cart_cache(None), [])
+        with self.settings(CART_CACHE='default'):
+            self.assertEqual([error.id for error in check_cart_cache(None)], ['LittleLemonAPI.E001'])
+
+    def test_max_items(self):
+        self.client.force_authenticate(user=self.carl)
+        for menuitem in self.menuitems[:2]:
+            self.client.post(URL, {'menuitem':menuitem.id, 'quantity':1})
+        response = self.client.post(URL, {'menuitem':self.menuitems[2].id, 'quantity':1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_checkout(self):
+        """
+        The cart reaches the database as order items, and is emptied once the order is committed
+        """
+        self.client.force_authenticate(user=self.carl)
+        self.client.post(URL, {'menuitem':self.menuitems[0].id, 'quantity':2})
+        self.client.post(URL, {'menuitem':self.menuitems[2].id, 'quantity':1})
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(URL).data), 2)
+        for callback in callbacks:
+            callback()
+        order = Order.objects.get(id=response.data['id'])
+        self.assertEqual(order.total, 5)
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(self.client.get(URL).data, [])
@@ -0,0 +1,107 @@
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from threading import Barrier, Event, Thread, Timer
+from ..coalescing import coalesce
+
+cache = caches['default']
+
+@override_settings(COALESCE_POLL_INTERVAL=0.01, COALESCE_LOCK_TIMEOUT=2)
+class CoalescingTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def _run_concurrently(self, count, target):
+        results = []
+        barrier = Barrier(count)
+        def run():
+            barrier.wait()
+            results.append(target())
+        threads = [Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_flight(self):
+        """
+        WHEN many threads miss the same key at once
+        THEN the value is computed once, and all of them get it
+        """
+        calls = []
+        release = Event()
+        def compute():
+            calls.append(1)
+            release.wait(1)
+            return 'menu'
+
+        Timer(0.1, release.set).start()
+        results = self._run_concurrently(10, lambda: coalesce(cache, 'key', compute, timeout=60))
+        self.assertEqual(results, ['menu'] * 10)
+        self.assertEqual(len(calls), 1)
+
+        # Cached afterwards
+        self.assertEqual(coalesce(cache, 'key', compute, timeout=60), 'menu')
+        self.assertEqual(len(calls), 1)
+
+    def test_version(self):
+        """
+        A value computed for another version is refreshed
+        """
+        self.assertEqual(coalesce(cache, 'key', lambda: 'old', version=1), 'old')
+        self.assertEqual(coalesce(cache, 'key', lambda: 'new', version=1), 'old')
+        self.assertEqual(coalesce(cache, 'key', lambda: 'new', version=2), 'new')
+
+    def test_stale_while_revalidate(self):
+        """
+        While a refresh runs, callers with a stale value get it instead of waiting
+        """
+        coalesce(cache, 'key', lambda: 'old', version=1)
+
+        started = Event()
+        release = Event()
+        def compute():
+            started.set()
+            release.wait(1)
+            return 'new'
+
+        refresh = Thread(target=lambda: coalesce(cache, 'key', compute, version=2))
+        refresh.start()
+        started.wait(1)
+        self.assertEqual(coalesce(cache, 'key', compute, version=2), 'old')
+        release.set()
+        refresh.join()
+        self.assertEqual(coalesce(cache, 'key', compute, version=2), 'new')
+
+    def test_other_process(self):
+        """
+        WHEN another process holds the lock on a missing value
+        THEN callers wait for its result instead of computing it
+        """
+        cache.set('key:lock', True)
+        def other_process():
+            cache.set('key', {'value': 'theirs', 'version': None, 'fresh_until': None})
+            cache.delete('key:lock')
+        Timer(0.1, other_process).start()
+
+        self.assertEqual(coalesce(cache, 'key', lambda: 'ours'), 'theirs')
+
+    def test_other_process_stale(self):
+        """
+        WHEN another process is refreshing a stale value
+        THEN callers get the stale value right away
+        """
+        coalesce(cache, 'key', lambda: 'old', version=1)
+        cache.set('key:lock', True)
+        self.assertEqual(coalesce(cache, 'key', lambda: 'new', version=2), 'old')
+
+    def test_error(self):
+        """
+        Errors reach the caller, and release the lock
+        """
+        def compute():
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            coalesce(cache, 'key', compute)
+        self.assertEqual(coalesce(cache, 'key', lambda: 'menu'), 'menu')
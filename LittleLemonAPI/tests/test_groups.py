@@ -0,0 +1,73 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User, Group
+
+MANAGERS_URL = reverse('managers')
+CREW_URL = reverse('delivery_crew')
+
+class GroupsTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.manager = User.objects.create(username='manager')
+        self.manager_group = Group.objects.create(name='Manager')
+        self.crew_group = Group.objects.create(name='Delivery Crew')
+        self.manager.groups.add(self.manager_group)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        self.client.force_authenticate(user=self.manager)
+        return super().setUp()
+
+    def _crew(self):
+        return sorted(self.crew_group.user_set.values_list('username', flat=True))
+
+    def test_add_one(self):
+        response = self.client.post(MANAGERS_URL, {'username':'user0'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(self.users[0].groups.filter(name='Manager').exists())
+
+    def test_bulk_add(self):
+        """
+        WHEN a manager adds several users at once
+        THEN they are added with one lookup and one insert
+        AND users already in the group are left alone
+        """
+        self.users[0].groups.add(self.crew_group)
+        # Permission check, users, group, insert
+        with self.assertNumQueries(4):
+            response = self.client.post(CREW_URL, {'usernames':['user0', 'user1', 'user2']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self._crew(), ['user0', 'user1', 'user2'])
+
+    def test_bulk_add_unknown(self):
+        """
+        Nobody is added when a username doesn't exist
+        """
+        response = self.client.post(CREW_URL, {'usernames':['user0', 'nobody']}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['username'], ['nobody'])
+        self.assertEqual(self._crew(), [])
+
+    def test_bulk_add_invalid(self):
+        """
+        Usernames that aren't strings are rejected
+        """
+        for usernames in ['user0', [{'username':'user0'}], [['user0']], [None]]:
+            response = self.client.post(CREW_URL, {'usernames':usernames}, format='json')
+            self.assertEqual(response.status_code, 400, f'with usernames: {usernames}')
+        self.assertEqual(self.client.post(CREW_URL, {'username':{'id':1}}, format='json').status_code, 400)
+        self.assertEqual(self._crew(), [])
+
+    def test_bulk_remove(self):
+        self.crew_group.user_set.add(*self.users)
+        response = self.client.delete(CREW_URL, {'usernames':['user0', 'user2']}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self._crew(), ['user1'])
+
+    def test_remove_one(self):
+        self.crew_group.user_set.add(self.users[0])
+        url = reverse('delivery_crew') + f'/{self.users[0].id}'
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_customer(self):
+        self.client.force_authenticate(user=self.users[0])
+        self.assertEqual(self.client.post(MANAGERS_URL, {'username':'user0'}).status_code, 403)
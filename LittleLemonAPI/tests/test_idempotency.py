@@ -0,0 +1,132 @@
+from datetime import timedelta
+from hashlib import sha256
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from ..models import Category, MenuItem, Cart, Order, IdempotencyKey
+
+from rest_framework.status import (
+    HTTP_201_CREATED,
+    HTTP_404_NOT_FOUND,
+    HTTP_409_CONFLICT,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+ORDERS_URL = reverse('orders_list')
+CART_URL = reverse('cart')
+
+class IdempotencyTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+        self.customer2 = User.objects.create(username='customer2')
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+
+        self.client.force_authenticate(user=self.customer)
+        return super().setUp()
+
+    def test_checkout_retry(self):
+        """
+        WHEN a checkout is retried with the same Idempotency-Key
+        THEN the first response is returned again
+        AND no other order is created
+        """
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2})
+
+        first = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, HTTP_201_CREATED)
+
+        retry = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(retry.status_code, HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # A new key runs the checkout again
+        response = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout-2')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    def test_keys_per_user(self):
+        """
+        The same key from another user is a different request
+        """
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2}, HTTP_IDEMPOTENCY_KEY='key')
+        self.client.force_authenticate(user=self.customer2)
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':1}, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(Cart.objects.count(), 2)
+
+    def test_failure_releases_key(self):
+        """
+        A failed request can be retried with the same key
+        """
+        response = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':1})
+        response = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+
+    def test_key_reused(self):
+        """
+        Reusing a key for a different request is an error
+        """
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2}, HTTP_IDEMPOTENCY_KEY='key')
+        response = self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':3}, HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.status_code, HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Cart.objects.get().quantity, 2)
+
+    def test_in_progress(self):
+        """
+        A duplicate of a request that is still running is rejected, rather than run twice
+        """
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2})
+
+        # The key as reserved by a first request that hasn't finished
+        IdempotencyKey.objects.create(
+            user=self.customer, key=sha256(b'checkout').hexdigest(), fingerprint='', created=timezone.now())
+
+        response = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertEqual(response.status_code, HTTP_409_CONFLICT)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_stale_reservation(self):
+        """
+        GIVEN a key reserved by a request that died more than IDEMPOTENCY_LOCK_TIMEOUT ago
+        WHEN the request is retried
+        THEN it runs, and its response is kept for the key
+        """
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2})
+        created = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT + 1)
+        IdempotencyKey.objects.create(
+            user=self.customer, key=sha256(b'checkout').hexdigest(), fingerprint='', created=created)
+
+        response = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get().status, HTTP_201_CREATED)
+
+        retry = self.client.post(ORDERS_URL, HTTP_IDEMPOTENCY_KEY='checkout')
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_purge(self):
+        """
+        Purging deletes the expired responses and reservations, and keeps the others
+        """
+        now = timezone.now()
+        expired = now - timedelta(seconds=settings.IDEMPOTENCY_TIMEOUT + 1)
+        stuck = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT + 1)
+        IdempotencyKey.objects.bulk_create([
+            IdempotencyKey(user=self.customer, key='expired', fingerprint='', status=201, created=expired),
+            IdempotencyKey(user=self.customer, key='stuck', fingerprint='', created=stuck),
+            IdempotencyKey(user=self.customer, key='kept', fingerprint='', status=201, created=stuck),
+            IdempotencyKey(user=self.customer, key='running', fingerprint='', created=now),
+        ])
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertEqual(set(IdempotencyKey.objects.values_list('key', flat=True)), {'kept', 'running'})
@@ -0,0 +1,143 @@
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from django.contrib.auth.models import User
+from ..models import Category, MenuItem, Cart, Order
+from threading import Barrier, Thread
+
+from rest_framework.status import (
+    HTTP_201_CREATED,
+    HTTP_409_CONFLICT,
+    )
+
+ORDERS_URL = reverse('orders_list')
+CART_URL = reverse('cart')
+MENU_URL = reverse('menuitems_list')
+
+class InventoryTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category, stock=3)
+        self.cake = MenuItem.objects.create(title='cake', price=3, category=category, stock=1)
+        self.water = MenuItem.objects.create(title='water', price=1, category=category)
+
+        self.client.force_authenticate(user=self.customer)
+        return super().setUp()
+
+    def _addToCart(self, menuitem, quantity):
+        Cart.objects.create(user=self.customer, menuitem=menuitem, quantity=quantity,
+                            unit_price=menuitem.price, price=menuitem.price * quantity)
+
+    def test_checkout(self):
+        """
+        Checkout takes the stock of tracked items, and leaves untracked items alone
+        """
+        self._addToCart(self.bread, 2)
+        self._addToCart(self.water, 10)
+
+        response = self.client.post(ORDERS_URL)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(MenuItem.objects.get(id=self.bread.id).stock, 1)
+        self.assertEqual(MenuItem.objects.get(id=self.water.id).stock, None)
+
+    def test_checkout_short(self):
+        """
+        If any line is short, nothing is ordered and no stock is taken
+        """
+        self._addToCart(self.bread, 2)
+        self._addToCart(self.cake, 2)
+
+        response = self.client.post(ORDERS_URL)
+        self.assertEqual(response.status_code, HTTP_409_CONFLICT)
+        self.assertEqual(response.data, {'menuitem': [str(self.cake.id)]})
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Cart.objects.count(), 2)
+        self.assertEqual(MenuItem.objects.get(id=self.bread.id).stock, 3)
+        self.assertEqual(MenuItem.objects.get(id=self.cake.id).stock, 1)
+
+    def test_cart_short(self):
+        """
+        Items can't be added to the cart beyond their stock
+        """
+        response = self.client.post(CART_URL, {'menuitem':self.cake.id, 'quantity':2})
+        self.assertEqual(response.status_code, HTTP_409_CONFLICT)
+        self.assertEqual(Cart.objects.count(), 0)
+
+    def test_availability(self):
+        """
+        The menu shows items as unavailable once they sell out
+        """
+        response = self.client.get(MENU_URL)
+        self.assertEqual([x.get('available') for x in response.data.get('results')], [True, True, True])
+        self.assertNotIn('stock', response.data.get('results')[0])
+
+        self._addToCart(self.cake, 1)
+        self.client.post(ORDERS_URL)
+
+        response = self.client.get(MENU_URL)
+        self.assertEqual([x.get('available') for x in response.data.get('results')], [True, False, True])
+
+    def test_failed_order(self):
+        """
+        GIVEN a checkout whose order fails to be written, after taking the stock
+        THEN the stock is given back, and items that sold out are shown available again
+        """
+        self._addToCart(self.cake, 1)
+
+        def fail(sender, instance, **kwargs):
+            # The menu is read while the cake is sold out
+            APIClient().get(MENU_URL)
+            raise RuntimeError('order not written')
+        pre_save.connect(fail, sender=Order)
+        self.addCleanup(pre_save.disconnect, fail, sender=Order)
+
+        with self.assertRaises(RuntimeError):
+            self.client.post(ORDERS_URL)
+        self.assertEqual(MenuItem.objects.get(id=self.cake.id).stock, 1)
+        self.assertEqual(Cart.objects.count(), 1)
+
+        response = self.client.get(MENU_URL)
+        self.assertEqual([x.get('available') for x in response.data.get('results')], [True, True, True])
+
+class ConcurrentCheckoutTest(APITransactionTestCase):
+
+    def test_concurrent_checkout(self):
+        """
+        WHEN many customers check out the same item at once
+        THEN exactly as many orders as the stock allows are created
+        AND the others fail without taking any stock
+        """
+        stock = 5
+        customers = 12
+        category = Category.objects.create(title='appetizer')
+        bread = MenuItem.objects.create(title='bread', price=2, category=category, stock=stock)
+        users = [User.objects.create(username=f'customer{i}') for i in range(customers)]
+        Cart.objects.bulk_create([Cart(user=user, menuitem=bread, quantity=1, unit_price=2, price=2) for user in users])
+
+        barrier = Barrier(customers)
+        statuses = []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                barrier.wait()
+                statuses.append(client.post(ORDERS_URL).status_code)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses.count(HTTP_201_CREATED), stock, statuses)
+        self.assertEqual(statuses.count(HTTP_409_CONFLICT), customers - stock)
+        self.assertEqual(Order.objects.count(), stock)
+        self.assertEqual(MenuItem.objects.get(id=bread.id).stock, 0)
+        self.assertEqual(Cart.objects.count(), customers - stock)
@@ -0,0 +1,131 @@
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from ..models import Job
+from ..jobs import enqueue, claim_job, run_job, requeue_lost_jobs, work
+from datetime import timedelta
+from threading import Lock
+
+calls = []
+calls_lock = Lock()
+
+def record(value):
+    with calls_lock:
+        calls.append(value)
+
+def fail():
+    raise ValueError('failed')
+
+class JobsTest(TestCase):
+
+    def setUp(self) -> None:
+        calls.clear()
+
+    def test_priority(self):
+        """
+        Jobs run highest priority first, then oldest first
+        """
+        enqueue(record, 'low', priority=-1)
+        enqueue(record, 'first')
+        enqueue('LittleLemonAPI.tests.test_jobs.record', 'second')
+        enqueue(record, 'high', priority=5)
+        enqueue(record, 'later', delay=60)
+
+        self.assertEqual(work('worker'), 4)
+        self.assertEqual(calls, ['high', 'first', 'second', 'low'])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 4)
+        self.assertEqual(Job.objects.get(status=Job.QUEUED).args, ['later'])
+
+    def test_claim(self):
+        """
+        A job can only be claimed once
+        """
+        job = enqueue(record, 'once')
+        claimed = claim_job('worker1')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, Job.RUNNING)
+        self.assertEqual(claimed.locked_by, 'worker1')
+        self.assertIsNone(claim_job('worker2'))
+
+    @override_settings(JOBS_RETRY_BACKOFF=10)
+    def test_retry(self):
+        """
+        Failed jobs are retried with backoff, then marked failed
+        """
+        job = enqueue(fail, max_attempts=2)
+        work('worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('ValueError', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+
+        # Not due yet
+        self.assertEqual(work('worker'), 0)
+
+        Job.objects.update(run_after=timezone.now())
+        work('worker')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_lost_jobs(self):
+        """
+        Jobs held too long by a worker are queued again
+        """
+        enqueue(record, 'lost')
+        claim_job('worker1')
+        self.assertEqual(requeue_lost_jobs(), 0)
+
+        Job.objects.update(locked_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(requeue_lost_jobs(), 1)
+        self.assertEqual(claim_job('worker2').locked_by, 'worker2')
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_lost_jobs_out_of_attempts(self):
+        """
+        Lost jobs without attempts left are failed instead of queued again
+        """
+        job = enqueue(record, 'lost', max_attempts=1)
+        claim_job('worker1')
+        Job.objects.update(locked_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(requeue_lost_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.locked_by, '')
+        self.assertIsNone(claim_job('worker2'))
+
+    @override_settings(JOBS_LOCK_TIMEOUT=60)
+    def test_lost_job_result(self):
+        """
+        GIVEN a job lost by a slow worker and claimed again by another
+        WHEN the slow worker finishes it
+        THEN the job stays with the new worker
+        """
+        enqueue(record, 'slow')
+        slow = claim_job('worker1')
+        Job.objects.update(locked_at=timezone.now() - timedelta(minutes=2))
+        requeue_lost_jobs()
+        claim_job('worker2')
+
+        run_job(slow)
+        job = Job.objects.get(id=slow.id)
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.locked_by, 'worker2')
+
+class WorkerTest(TransactionTestCase):
+
+    def test_concurrency(self):
+        """
+        WHEN several workers run at once
+        THEN every job runs exactly once
+        """
+        calls.clear()
+        for i in range(30):
+            enqueue(record, i)
+
+        call_command('run_jobs', '--once', '--concurrency', '4')
+        self.assertEqual(sorted(calls), list(range(30)))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 30)
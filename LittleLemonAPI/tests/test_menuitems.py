@@ -1,8 +1,16 @@
+import threading
+import warnings
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import connections, transaction
+from django.db.models.signals import pre_save
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase, APITransactionTestCase
 from ..models import Category, MenuItem
+from ..serializers import MenuItemSerializer
 
 LIST_URL = reverse('menuitems_list')
+CHANGES_URL = reverse('menuitems_changes')
 
 class MenuItemsTest(APITestCase):
 
@@ -49,3 +57,216 @@ class MenuItemsTest(APITestCase):
             response = self.client.get(LIST_URL + params)
             actual = [x.get('title') for x in response.data.get('results')]
             self.assertSetEqual(set(actual), set(expected), f"with params: {params}")
+
+    def test_snapshot(self):
+        """
+        Unfiltered and category lists are served from the snapshot, with the same content as the database
+        """
+        Category.objects.filter(title='entree').update(slug='entree')
+        MenuItem.objects.bulk_create([
+            MenuItem(title=f'pasta {i}', category=self.categories[1], price=i) for i in range(12)
+        ])
+
+        response = self.client.get(LIST_URL + '?category=entree')
+        serializer = MenuItemSerializer(MenuItem.objects.filter(category__slug='entree'), many=True)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.data.get('count'), 13)
+        self.assertEqual(response.data.get('results'), serializer.data[:10])
+        self.assertTrue(response.data.get('next').endswith('?category=entree&page=2'))
+
+        response = self.client.get(LIST_URL + '?category=entree&page=2')
+        self.assertEqual(response.data.get('results'), serializer.data[10:])
+
+        response = self.client.get(LIST_URL + '?page=2')
+        serializer = MenuItemSerializer(MenuItem.objects.all(), many=True)
+        self.assertEqual(response.data.get('results'), serializer.data[10:])
+
+        response = self.client.get(LIST_URL + '?category=nothing')
+        self.assertEqual(response.data.get('results'), [])
+
+        response = self.client.get(LIST_URL + '?page=9')
+        self.assertEqual(response.status_code, 404)
+
+    def test_snapshot_invalidation(self):
+        """
+        Changes through the API, the models or bulk updates are visible in the next request
+        """
+        self.client.get(LIST_URL)
+
+        admin = User.objects.create(username='admin', is_superuser=True)
+        self.client.force_authenticate(user=admin)
+        self.client.patch(f'{LIST_URL}/{self.menuitems[0].id}', {'title':'crisps'})
+        response = self.client.get(LIST_URL)
+        self.assertEqual(response.data.get('results')[0].get('title'), 'crisps')
+
+        item = MenuItem.objects.get(id=self.menuitems[1].id)
+        item.title = 'penne'
+        item.save()
+        response = self.client.get(LIST_URL)
+        self.assertEqual(response.data.get('results')[1].get('title'), 'penne')
+
+        MenuItem.objects.filter(id=self.menuitems[2].id).update(price=5)
+        response = self.client.get(LIST_URL)
+        self.assertEqual(response.data.get('results')[2].get('price'), '5.00')
+
+    def test_snapshot_after_rollback(self):
+        """
+        GIVEN a snapshot rendered inside a change that was rolled back
+        WHEN the next change reuses the id of its version
+        THEN that snapshot isn't served
+        """
+        chips, pasta, icecream = self.menuitems
+        try:
+            with transaction.atomic():
+                MenuItem.objects.filter(id=chips.id).update(title='crisps')
+                self.client.get(LIST_URL)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        MenuItem.objects.filter(id=pasta.id).update(title='penne')
+        response = self.client.get(LIST_URL)
+        self.assertEqual([x.get('title') for x in response.data.get('results')], ['chips', 'penne', 'icecream'])
+
+    def test_changes(self):
+        """
+        Only the items and categories changed or deleted since the given version are returned
+        """
+        response = self.client.get(CHANGES_URL)
+        self.assertEqual(len(response.data.get('menu_items')), 3)
+        self.assertEqual(len(response.data.get('categories')), 3)
+        version = response.data.get('version')
+
+        response = self.client.get(CHANGES_URL + f'?since={version}')
+        self.assertEqual(response.data.get('version'), version)
+        self.assertEqual(response.data.get('menu_items'), [])
+        self.assertEqual(response.data.get('deleted_menu_items'), [])
+
+        chips, pasta, icecream = self.menuitems
+        pasta.price = 3
+        pasta.save()
+        MenuItem.objects.filter(id=icecream.id).delete()
+        soup = MenuItem.objects.create(title='soup', category=self.categories[0], price=4)
+
+        response = self.client.get(CHANGES_URL + f'?since={version}')
+        self.assertGreater(response.data.get('version'), version)
+        self.assertListEqual([x.get('id') for x in response.data.get('menu_items')], [pasta.id, soup.id])
+        self.assertEqual(response.data.get('menu_items')[0].get('price'), '3.00')
+        self.assertListEqual(response.data.get('deleted_menu_items'), [icecream.id])
+        self.assertListEqual(response.data.get('categories'), [])
+
+        response = self.client.get(CHANGES_URL + '?since=latest')
+        self.assertEqual(response.status_code, 400)
+
+    def test_price_range(self):
+        cases = [
+            ('?price_min=2',['pasta']),
+            ('?price_max=1',['chips','icecream']),
+            ('?price_min=1&price_max=1.50',['chips','icecream']),
+        ]
+
+        for i, (params,expected) in enumerate(cases):
+            response = self.client.get(LIST_URL + params)
+            actual = [x.get('title') for x in response.data.get('results')]
+            self.assertSetEqual(set(actual), set(expected), f"with params: {params}")
+
+        for params in ['?price_min=cheap', '?price_min=nan', '?price_max=Infinity', '?price_max=-inf']:
+            response = self.client.get(LIST_URL + params)
+            self.assertEqual(response.status_code, 400, f"with params: {params}")
+
+    def test_facets(self):
+        """
+        Facet counts follow the current filters
+        """
+        MenuItem.objects.bulk_create([
+            MenuItem(title='steak', category=self.categories[1], price=25, featured=True),
+            MenuItem(title='salad', category=self.categories[0], price=7),
+        ])
+
+        # Menu version, count, page and facets
+        with self.assertNumQueries(4):
+            response = self.client.get(LIST_URL + '?facets=1')
+        facets = response.data.get('facets')
+        self.assertListEqual(
+            [(x.get('id'), x.get('count')) for x in facets.get('category')],
+            [(self.categories[0].id, 2), (self.categories[1].id, 2), (self.categories[2].id, 1)])
+        self.assertDictEqual(facets.get('featured'), {'true': 1, 'false': 4})
+        self.assertListEqual([x.get('count') for x in facets.get('price')], [3, 1, 0, 1])
+        self.assertEqual(facets.get('price')[0].get('min'), None)
+        self.assertEqual(facets.get('price')[-1].get('max'), None)
+
+        response = self.client.get(LIST_URL + '?facets=1&search=a')
+        facets = response.data.get('facets')
+        self.assertListEqual(
+            [(x.get('id'), x.get('count')) for x in facets.get('category')],
+            [(self.categories[0].id, 1), (self.categories[1].id, 2), (self.categories[2].id, 1)])
+        self.assertListEqual([x.get('count') for x in facets.get('price')], [2, 1, 0, 1])
+
+        response = self.client.get(LIST_URL)
+        self.assertNotIn('facets', response.data)
+
+    def test_list_cache(self):
+        """
+        Identical filtered lists are computed once per menu version
+        """
+        response = self.client.get(LIST_URL + '?search=a&sort=title')
+        # Only the menu version
+        with self.assertNumQueries(1):
+            cached = self.client.get(LIST_URL + '?sort=title&search=a')
+        self.assertEqual(cached.data, response.data)
+
+        # Unknown parameters share the entry, and any value makes a valid cache key
+        with self.assertNumQueries(1):
+            self.client.get(LIST_URL + '?search=a&sort=title&utm_source=mail')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.client.get(LIST_URL, {'search': 'a dish ' * 50})
+
+        MenuItem.objects.filter(title='pasta').update(title='salad')
+        response = self.client.get(LIST_URL + '?search=a&sort=title')
+        self.assertEqual([x.get('title') for x in response.data.get('results')], ['icecream', 'salad'])
+
+
+class MenuChangesConcurrencyTest(APITransactionTestCase):
+
+    def test_interleaved_saves(self):
+        """
+        GIVEN a save that has allocated its version but not written its row yet
+        WHEN another save runs, and a client syncs meanwhile
+        THEN the next sync from the returned version includes both changes
+        """
+        category = Category.objects.create(title='appetizer')
+        chips = MenuItem.objects.create(title='chips', category=category, price=1)
+        pasta = MenuItem.objects.create(title='pasta', category=category, price=2)
+
+        allocated = threading.Event()
+        resume = threading.Event()
+
+        def pause(sender, instance, **kwargs):
+            if instance.id == chips.id:
+                allocated.set()
+                resume.wait(5)
+        pre_save.connect(pause, sender=MenuItem)
+        self.addCleanup(pre_save.disconnect, pause, sender=MenuItem)
+
+        def save(item, price):
+            try:
+                item.price = price
+                item.save()
+            finally:
+                connections.close_all()
+
+        first = threading.Thread(target=save, args=(chips, 3))
+        second = threading.Thread(target=save, args=(pasta, 4))
+        first.start()
+        allocated.wait(5)
+        second.start()
+        second.join(0.5)
+
+        version = self.client.get(CHANGES_URL).data.get('version')
+        resume.set()
+        first.join()
+        second.join()
+
+        response = self.client.get(CHANGES_URL + f'?since={version}')
+        self.assertEqual(sorted(x.get('price') for x in response.data.get('menu_items')), ['3.00', '4.00'])
@@ -0,0 +1,29 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+
+class MiddlewareTest(TestCase):
+
+    def test_api_skips_session(self):
+        """
+        WHEN a token-authenticated request is made to the API
+        THEN no session or CSRF middleware runs
+        AND the user is still authenticated by the API
+        """
+        user = User.objects.create(username='customer')
+        token = Token.objects.create(user=user)
+
+        response = self.client.get('/api/cart/menu-items', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertEqual(response.wsgi_request.user, user)
+        self.assertNotIn('csrftoken', response.cookies)
+
+    def test_admin_keeps_session(self):
+        """
+        The admin still gets sessions and CSRF protection
+        """
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hasattr(response.wsgi_request, 'session'))
+        self.assertIn('csrftoken', response.cookies)
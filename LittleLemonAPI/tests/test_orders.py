@@ -145,17 +145,17 @@ class OrdersTest(APITestCase):
         Order.objects.bulk_create(orders)
 
         cases = [
-            ('', [1,2,3]),
-            ('?sort=total', [2,3,1]),
-            ('?sort=-total', [1,3,2]),
-            ('?sort=-date', [3,2,1]),
+            ('', [0,1,2]),
+            ('?sort=total', [1,2,0]),
+            ('?sort=-total', [0,2,1]),
+            ('?sort=-date', [2,1,0]),
         ]
 
         self.client.force_authenticate(user=self.manager)
         for i, (params,expected) in enumerate(cases):
             response = self.client.get(LIST_URL + params)
             actual = [x.get('id') for x in response.data.get('results')]
-            self.assertListEqual(actual, expected, f"with params: {params}")
+            self.assertListEqual(actual, [orders[j].id for j in expected], f"with params: {params}")
 
 
     def test_manager_retrieve(self):
@@ -254,3 +254,67 @@ class OrdersTest(APITestCase):
         self.assertEqual(response.status_code, HTTP_403_FORBIDDEN, 'patch:delivery_crew')
         db_order = Order.objects.get(id=order.id)
         self.assertEqual(db_order.delivery_crew, self.delivery, 'db_order.delivery_crew')
+
+    def test_manager_bulk_update(self):
+        """
+        Updates several orders in a single request
+        """
+        order1 = self._createOrder(user=self.customer)
+        order2 = self._createOrder(user=self.customer)
+        order3 = self._createOrder(user=self.customer2)
+        self.client.force_authenticate(user=self.manager)
+
+        response = self.client.patch(LIST_URL, [
+            {'id':order1.id, 'delivery_crew':self.delivery.id},
+            {'id':order2.id, 'delivery_crew':self.delivery.id, 'status':True},
+            {'id':order3.id, 'status':True},
+        ], format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+        db_orders = Order.objects.in_bulk([order1.id, order2.id, order3.id])
+        self.assertEqual(db_orders[order1.id].delivery_crew, self.delivery)
+        self.assertEqual(db_orders[order1.id].status, False)
+        self.assertEqual(db_orders[order2.id].delivery_crew, self.delivery)
+        self.assertEqual(db_orders[order2.id].status, True)
+        self.assertEqual(db_orders[order3.id].delivery_crew, None)
+        self.assertEqual(db_orders[order3.id].status, True)
+
+    def test_delivery_bulk_update(self):
+        """
+        Delivery crew can only update the status of their own orders, and nothing is saved otherwise
+        """
+        order1 = self._createOrder(user=self.customer, delivery_crew=self.delivery)
+        order2 = self._createOrder(user=self.customer, delivery_crew=self.delivery)
+        order3 = self._createOrder(user=self.customer, delivery_crew=self.delivery2)
+        self.client.force_authenticate(user=self.delivery)
+
+        response = self.client.patch(LIST_URL, [
+            {'id':order1.id, 'status':True},
+            {'id':order2.id, 'delivery_crew':self.delivery2.id},
+        ], format='json')
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN, 'patch:delivery_crew')
+
+        response = self.client.patch(LIST_URL, [
+            {'id':order1.id, 'status':True},
+            {'id':order3.id, 'status':True},
+        ], format='json')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND, 'patch:other crew')
+        self.assertEqual(Order.objects.filter(status=True).count(), 0)
+
+        response = self.client.patch(LIST_URL, [
+            {'id':order1.id, 'status':True},
+            {'id':order2.id, 'status':True},
+        ], format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK, 'patch:status')
+        self.assertEqual(Order.objects.filter(status=True).count(), 2)
+
+    def test_customer_bulk_update(self):
+        """
+        Customers cannot bulk update orders
+        """
+        order = self._createOrder(user=self.customer)
+        self.client.force_authenticate(user=self.customer)
+
+        response = self.client.patch(LIST_URL, [{'id':order.id, 'status':True}], format='json')
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
@@ -0,0 +1,141 @@
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from django.contrib.auth.models import User, Group
+from ..models import Category, MenuItem, Cart, OutboxEvent
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from threading import Thread
+import json
+
+ORDERS_URL = reverse('orders_list')
+def DETAIL_URL(pk): return reverse('orders_detail', kwargs={'pk':pk})
+
+class StubServer:
+    """Local HTTP endpoint recording the batches it receives, answering with the given status"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.batches = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.batches.append(json.loads(body)['events'])
+                self.send_response(stub.status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/events'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class OutboxTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+        self.manager = User.objects.create(username='manager')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+
+        self.stub = StubServer()
+        self.addCleanup(self.stub.close)
+        return super().setUp()
+
+    def _dispatch(self):
+        with override_settings(OUTBOX_ENDPOINTS=[self.stub.url]):
+            call_command('dispatch_outbox', '--once', stdout=StringIO())
+
+    def _checkout(self):
+        Cart.objects.create(user=self.customer, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+        self.client.force_authenticate(user=self.customer)
+        return self.client.post(ORDERS_URL).data['id']
+
+    def test_events(self):
+        """
+        WHEN orders are created and updated
+        THEN an event is recorded for each change
+        AND the dispatcher delivers them in one batch, in order
+        """
+        order = self._checkout()
+        self.client.force_authenticate(user=self.manager)
+        self.client.patch(DETAIL_URL(order), {'status':1})
+        self.assertEqual(OutboxEvent.objects.filter(delivered__isnull=True).count(), 2)
+
+        self._dispatch()
+        self.assertEqual(len(self.stub.batches), 1)
+        events = self.stub.batches[0]
+        self.assertEqual([(x['type'], x['order']) for x in events], [('order.created', order), ('order.updated', order)])
+        self.assertEqual(events[1]['payload']['status'], True)
+        self.assertEqual(OutboxEvent.objects.filter(delivered__isnull=True).count(), 0)
+
+        # Delivered events are not sent again
+        self._dispatch()
+        self.assertEqual(len(self.stub.batches), 1)
+
+    def test_retry(self):
+        """
+        A failed batch is retried later, with increasing backoff
+        """
+        self._checkout()
+        self.stub.status = 500
+        self._dispatch()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNone(event.delivered)
+        self.assertGreater(event.next_attempt, timezone.now())
+
+        # Not due yet
+        self.stub.status = 200
+        self._dispatch()
+        self.assertEqual(len(self.stub.batches), 1)
+
+        OutboxEvent.objects.update(next_attempt=timezone.now() - timedelta(seconds=1))
+        self._dispatch()
+        self.assertEqual(len(self.stub.batches), 2)
+        self.assertIsNotNone(OutboxEvent.objects.get().delivered)
+
+    def test_order_per_order(self):
+        """
+        Events of an order wait for its earlier events, without holding back other orders
+        """
+        first = self._checkout()
+        second = self._checkout()
+        self.client.force_authenticate(user=self.manager)
+        self.client.patch(DETAIL_URL(first), {'status':1})
+
+        # The first order's creation is waiting for a retry
+        OutboxEvent.objects.filter(order=first, type='order.created').update(
+            attempts=1, next_attempt=timezone.now() + timedelta(minutes=1))
+
+        self._dispatch()
+        self.assertEqual([(x['type'], x['order']) for x in self.stub.batches[0]], [('order.created', second)])
+
+    def test_bulk_update(self):
+        first = self._checkout()
+        second = self._checkout()
+        self.client.force_authenticate(user=self.manager)
+        self.client.patch(ORDERS_URL, [{'id':first, 'status':True}, {'id':second}], format='json')
+        self.assertListEqual(
+            list(OutboxEvent.objects.filter(type='order.updated').values_list('order', flat=True)), [first])
+
+    def test_rolled_back(self):
+        """
+        No event is recorded for a change that fails
+        """
+        order = self._checkout()
+        self.client.force_authenticate(user=self.manager)
+        self.client.patch(DETAIL_URL(order), {'delivery_crew':999})
+        self.assertEqual(OutboxEvent.objects.filter(type='order.updated').count(), 0)
@@ -0,0 +1,40 @@
+from django.db import connection
+from rest_framework.test import APITestCase
+from ..queryaudit import ROLES, audit, explain, seed
+from .. import urls
+
+
+class QueryAuditTest(APITestCase):
+
+    def test_explain(self):
+        plan, flags = explain(connection, 'SELECT * FROM "LittleLemonAPI_menuitem" WHERE "title" LIKE \'%bread%\'')
+        self.assertEqual([flag['kind'] for flag in flags], ['scan'])
+        self.assertEqual(flags[0]['table'], 'LittleLemonAPI_menuitem')
+
+        plan, flags = explain(connection, 'SELECT * FROM "LittleLemonAPI_menuitem" WHERE "price" = 2 ORDER BY "stock"')
+        self.assertEqual([flag['kind'] for flag in flags], ['temp_btree'])
+
+    def test_audit(self):
+        """
+        WHEN every route is audited as every role
+        THEN the report covers all routes
+        AND flags the scan of menu item searches, while the customer's orders are read through an index
+        """
+        report = audit(seed(items=20, customers=2))
+        self.assertEqual(report['routes_not_exercised'], [])
+        self.assertEqual(set(request['route'] for request in report['requests']),
+                         set(str(pattern.pattern) for pattern in urls.urlpatterns))
+        self.assertEqual(set(request['role'] for request in report['requests']), set(ROLES))
+        self.assertEqual(report['summary']['missing_index'], 0)
+        self.assertEqual(report['summary']['server_errors'], len(report['server_errors']))
+        self.assertNotIn(('cart/menu-items', 'GET'),
+                         [(error['route'], error['method']) for error in report['server_errors']])
+
+        search = [request for request in report['requests'] if request['path'] == '/api/menu-items'
+                  and request['role'] == 'customer' and request['method'] == 'GET' and request['findings']]
+        tables = [flag.get('table') for request in search for finding in request['findings'] for flag in finding['flags']]
+        self.assertIn('LittleLemonAPI_menuitem', tables)
+
+        orders = [request for request in report['requests'] if request['route'] == 'orders/<int:pk>'
+                  and request['role'] == 'customer' and request['method'] == 'GET'][0]
+        self.assertEqual(orders['findings'], [])
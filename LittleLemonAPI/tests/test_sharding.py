@@ -0,0 +1,217 @@
+import threading
+from django.core.management import call_command
+from django.db import connections
+from django.db.models.signals import pre_save
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from django.contrib.auth.models import User, Group
+from ..models import Category, MenuItem, Cart, Order, OrderItem, OutboxEvent, UserOrderStats
+from ..sharding import rebalance_orders
+from io import StringIO
+
+ORDERS_URL = reverse('orders_list')
+CART_URL = reverse('cart')
+def DETAIL_URL(pk): return reverse('orders_detail', kwargs={'pk':pk})
+
+SHARDS = ['default', 'orders_1']
+
+class ShardingTest(APITestCase):
+    databases = {'default', 'orders_1'}
+
+    def setUp(self) -> None:
+        self.customers = [User.objects.create(username=f'customer{i}') for i in range(4)]
+        self.manager = User.objects.create(username='manager')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        self.crew = User.objects.create(username='crew')
+        self.crew.groups.add(Group.objects.create(name='Delivery Crew'))
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        return super().setUp()
+
+    def _checkout(self, user):
+        self.client.force_authenticate(user=user)
+        self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':1})
+        return self.client.post(ORDERS_URL).data['id']
+
+    def _shard_of_user(self, user):
+        # With two shards, users with an even id are in 'default' and the others in 'orders_1'
+        return SHARDS[user.id % 2]
+
+    def _shard_of(self, id):
+        return [db for db in SHARDS if Order.objects.using(db).filter(id=id).exists()]
+
+    @override_settings(ORDER_SHARDS=SHARDS)
+    def test_checkout(self):
+        """
+        WHEN customers check out
+        THEN each order, with its items and event, is written to the shard of its customer
+        AND order ids are unique across shards
+        """
+        ids = [self._checkout(customer) for customer in self.customers]
+        self.assertEqual(len(set(ids)), 4)
+        for customer, id in zip(self.customers, ids):
+            shard = self._shard_of_user(customer)
+            self.assertEqual(self._shard_of(id), [shard])
+            self.assertTrue(OrderItem.objects.using(shard).filter(order=id).exists())
+            self.assertTrue(OutboxEvent.objects.using(shard).filter(order=id).exists())
+        for db in SHARDS:
+            self.assertFalse(Cart.objects.using(db).exists())
+
+    @override_settings(ORDER_SHARDS=SHARDS)
+    def test_lists(self):
+        """
+        Customers read their own shard, managers and delivery crew every shard, merged in order
+        """
+        ids = [self._checkout(customer) for customer in self.customers]
+
+        self.client.force_authenticate(user=self.customers[1])
+        response = self.client.get(ORDERS_URL)
+        self.assertEqual([x['id'] for x in response.data['results']], [ids[1]])
+
+        self.client.force_authenticate(user=self.manager)
+        response = self.client.get(ORDERS_URL)
+        self.assertEqual([x['id'] for x in response.data['results']], ids)
+        response = self.client.get(ORDERS_URL, {'sort':'-id'})
+        self.assertEqual([x['id'] for x in response.data['results']], ids[::-1])
+
+        for i in [1, 2]:
+            Order.objects.using(self._shard_of_user(self.customers[i])).filter(id=ids[i]).update(delivery_crew=self.crew)
+        self.client.force_authenticate(user=self.crew)
+        response = self.client.get(ORDERS_URL)
+        self.assertEqual(sorted(x['id'] for x in response.data['results']), [ids[1], ids[2]])
+
+    @override_settings(ORDER_SHARDS=SHARDS)
+    def test_updates(self):
+        ids = [self._checkout(customer) for customer in self.customers]
+
+        self.client.force_authenticate(user=self.manager)
+        response = self.client.patch(DETAIL_URL(ids[1]), {'delivery_crew':self.crew.id})
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.using(self._shard_of_user(self.customers[1])).get(id=ids[1])
+        self.assertEqual(order.delivery_crew_id, self.crew.id)
+
+        # A bulk update spans both shards
+        response = self.client.patch(ORDERS_URL, [{'id':id, 'status':True} for id in ids], format='json')
+        self.assertEqual([x['id'] for x in response.data], ids)
+        for db in SHARDS:
+            self.assertFalse(Order.objects.using(db).filter(status=False).exists())
+        self.assertEqual(self.customers[1].order_stats.delivered_count, 1)
+
+    def test_rebalance(self):
+        """
+        GIVEN orders and carts in a single database
+        WHEN a shard is added and rebalance_orders runs
+        THEN the users whose shard changed are moved there, with their order items, events and carts
+        """
+        with override_settings(ORDER_SHARDS=['default']):
+            ids = [self._checkout(customer) for customer in self.customers]
+            self.client.post(CART_URL, {'menuitem':self.bread.id, 'quantity':2})
+
+        with override_settings(ORDER_SHARDS=SHARDS):
+            call_command('rebalance_orders', stdout=StringIO())
+            for customer, id in zip(self.customers, ids):
+                self.assertEqual(self._shard_of(id), [self._shard_of_user(customer)])
+            self.assertEqual(OrderItem.objects.using('orders_1').count(), 2)
+            self.assertEqual(OutboxEvent.objects.using('orders_1').count(), 2)
+            self.assertEqual(Cart.objects.using(self._shard_of_user(self.customers[3])).get().quantity, 2)
+
+            # Moved orders are found from their id
+            self.client.force_authenticate(user=self.manager)
+            for id in ids:
+                self.assertEqual(self.client.get(DETAIL_URL(id)).status_code, 200)
+
+            # Nothing left to move
+            self.assertEqual(rebalance_orders(), 0)
+
+            # Ids allocated by the new shard come after the moved ones
+            customer = [customer for customer in self.customers if self._shard_of_user(customer) == 'orders_1'][0]
+            self.assertGreater(self._checkout(customer), max(ids))
+
+
+@override_settings(ORDER_SHARDS=SHARDS)
+class ConcurrentShardsTest(APITransactionTestCase):
+    databases = {'default', 'orders_1'}
+
+    def setUp(self) -> None:
+        self.customers = [User.objects.create(username=f'customer{i}') for i in range(4)]
+        self.manager = User.objects.create(username='manager')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category, stock=10)
+        self.statuses = []
+        return super().setUp()
+
+    def _customer_in(self, db, index=0):
+        return [customer for customer in self.customers if SHARDS[customer.id % 2] == db][index]
+
+    def _request(self, user, method, url, data=None):
+        try:
+            client = APIClient()
+            client.force_authenticate(user=user)
+            self.statuses.append(getattr(client, method)(url, data, format='json').status_code)
+        finally:
+            connections.close_all()
+
+    def _checkout(self, user):
+        Cart.objects.using(SHARDS[user.id % 2]).create(
+            user=user, menuitem=self.bread, quantity=1, unit_price=2, price=2)
+        self._request(user, 'post', ORDERS_URL)
+
+    def _pause_checkout(self, user):
+        """Starts a checkout, and returns once it is writing its order, with the event that resumes it"""
+        paused = threading.Event()
+        resume = threading.Event()
+
+        def pause(sender, instance, **kwargs):
+            if not paused.is_set():
+                paused.set()
+                resume.wait(5)
+        pre_save.connect(pause, sender=Order)
+        self.addCleanup(pre_save.disconnect, pause, sender=Order)
+
+        thread = threading.Thread(target=self._checkout, args=(user,))
+        thread.start()
+        paused.wait(5)
+        return thread, resume
+
+    def test_checkout_and_update(self):
+        """
+        GIVEN a checkout writing its order in a shard
+        WHEN a manager changes the status of another order of the shard
+        THEN both succeed: neither holds a lock of the default database while waiting for the shard
+        """
+        customer = self._customer_in('orders_1')
+        self._checkout(self._customer_in('orders_1', 1))
+        order = Order.objects.using('orders_1').get()
+
+        checkout, resume = self._pause_checkout(customer)
+        update = threading.Thread(
+            target=self._request, args=(self.manager, 'patch', DETAIL_URL(order.id), {'status':True}))
+        update.start()
+        update.join(0.5)
+        resume.set()
+        checkout.join()
+        update.join()
+
+        self.assertEqual(self.statuses, [201, 201, 200])
+        self.assertEqual(UserOrderStats.objects.get(user=order.user_id).delivered_count, 1)
+        self.assertEqual(MenuItem.objects.get(id=self.bread.id).stock, 8)
+
+    def test_checkouts_in_other_shards(self):
+        """
+        GIVEN a checkout writing its order in a shard
+        THEN a checkout in another shard doesn't wait for it
+        """
+        checkout, resume = self._pause_checkout(self._customer_in('orders_1'))
+        other = threading.Thread(target=self._checkout, args=(self._customer_in('default'),))
+        other.start()
+        other.join(2)
+        finished = not other.is_alive()
+        resume.set()
+        checkout.join()
+        other.join()
+
+        self.assertTrue(finished)
+        self.assertEqual(self.statuses, [201, 201])
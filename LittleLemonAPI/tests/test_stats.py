@@ -0,0 +1,195 @@
+import threading
+from django.core.management import call_command
+from django.db import connections
+from django.db.models.signals import pre_save
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from django.contrib.auth.models import User, Group
+from ..models import Category, MenuItem, Cart, Order, UserOrderStats
+from decimal import Decimal
+from io import StringIO
+
+ORDERS_URL = reverse('orders_list')
+SUMMARY_URL = reverse('orders_summary')
+def DETAIL_URL(pk): return reverse('orders_detail', kwargs={'pk':pk})
+
+class OrderStatsTest(APITestCase):
+
+    def setUp(self) -> None:
+        self.customer = User.objects.create(username='customer')
+        self.other = User.objects.create(username='other')
+        self.manager = User.objects.create(username='manager')
+        self.manager.groups.add(Group.objects.create(name='Manager'))
+
+        category = Category.objects.create(title='appetizer')
+        self.bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        return super().setUp()
+
+    def _checkout(self, user, quantity=1):
+        Cart.objects.create(user=user, menuitem=self.bread, quantity=quantity, unit_price=2, price=2 * quantity)
+        self.client.force_authenticate(user=user)
+        return self.client.post(ORDERS_URL).data['id']
+
+    def _stats(self, user):
+        return UserOrderStats.objects.filter(user=user).values(
+            'order_count', 'delivered_count', 'lifetime_spend').first()
+
+    def test_checkout(self):
+        """
+        WHEN a user checks out
+        THEN their order count and lifetime spend go up in the same transaction
+        """
+        self._checkout(self.customer)
+        self._checkout(self.customer, quantity=3)
+        self.assertEqual(self._stats(self.customer),
+            {'order_count': 2, 'delivered_count': 0, 'lifetime_spend': Decimal('8.00')})
+        self.assertIsNone(self._stats(self.other))
+
+    def test_status_changes(self):
+        """
+        Delivered counts follow status changes, one order at a time or in bulk
+        """
+        first = self._checkout(self.customer)
+        second = self._checkout(self.customer)
+        self.client.force_authenticate(user=self.manager)
+        self.client.patch(DETAIL_URL(first), {'status':1})
+        self.assertEqual(self._stats(self.customer)['delivered_count'], 1)
+
+        # first is already delivered and must not be counted twice
+        self.client.patch(ORDERS_URL, [{'id':first, 'status':True}, {'id':second, 'status':True}], format='json')
+        self.assertEqual(self._stats(self.customer)['delivered_count'], 2)
+
+        self.client.patch(ORDERS_URL, [{'id':first, 'status':False}], format='json')
+        self.assertEqual(self._stats(self.customer)['delivered_count'], 1)
+
+    def test_summary(self):
+        self._checkout(self.customer)
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.get(SUMMARY_URL)
+        self.assertEqual(response.data['order_count'], 1)
+        self.assertEqual(response.data['lifetime_spend'], '2.00')
+
+        # Users without orders have zero counts
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get(SUMMARY_URL).data['order_count'], 0)
+
+        # Only managers may look at other users
+        self.assertEqual(self.client.get(SUMMARY_URL, {'user':self.customer.id}).status_code, 403)
+        self.client.force_authenticate(user=self.manager)
+        self.assertEqual(self.client.get(SUMMARY_URL, {'user':self.customer.id}).data['order_count'], 1)
+
+    def test_rebuild(self):
+        """
+        GIVEN stats that drifted from the orders
+        WHEN rebuild_order_stats runs
+        THEN they match the orders again
+        """
+        self._checkout(self.customer)
+        self._checkout(self.other)
+        Order.objects.filter(user=self.other).update(status=True)
+        UserOrderStats.objects.filter(user=self.customer).delete()
+
+        call_command('rebuild_order_stats', stdout=StringIO())
+        self.assertEqual(self._stats(self.customer),
+            {'order_count': 1, 'delivered_count': 0, 'lifetime_spend': Decimal('2.00')})
+        self.assertEqual(self._stats(self.other)['delivered_count'], 1)
+
+
+class ConcurrentStatusTest(APITransactionTestCase):
+
+    def test_concurrent_deliveries(self):
+        """
+        GIVEN two managers marking the same order delivered at the same time
+        WHEN both requests read the order before either writes
+        THEN the order is only counted once
+        """
+        customer = User.objects.create(username='customer')
+        manager = User.objects.create(username='manager')
+        manager.groups.add(Group.objects.create(name='Manager'))
+        category = Category.objects.create(title='appetizer')
+        bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        Cart.objects.create(user=customer, menuitem=bread, quantity=1, unit_price=2, price=2)
+        self.client.force_authenticate(user=customer)
+        order = self.client.post(ORDERS_URL).data['id']
+
+        paused = threading.Event()
+        resume = threading.Event()
+
+        def pause(sender, instance, **kwargs):
+            if not paused.is_set():
+                paused.set()
+                resume.wait(5)
+        pre_save.connect(pause, sender=Order)
+        self.addCleanup(pre_save.disconnect, pause, sender=Order)
+
+        def deliver():
+            try:
+                client = APIClient()
+                client.force_authenticate(user=manager)
+                client.patch(DETAIL_URL(order), {'status':1})
+            finally:
+                connections.close_all()
+
+        first = threading.Thread(target=deliver)
+        second = threading.Thread(target=deliver)
+        first.start()
+        paused.wait(5)
+        second.start()
+        second.join(0.5)
+        resume.set()
+        first.join()
+        second.join()
+
+        self.assertTrue(Order.objects.get(id=order).status)
+        self.assertEqual(UserOrderStats.objects.get(user=customer).delivered_count, 1)
+
+    def test_checkout_during_rebuild(self):
+        """
+        GIVEN rebuild_order_stats that has read the orders but not the archived ones
+        WHEN a customer checks out before it writes the totals
+        THEN the new order is still counted once the rebuild is done
+        """
+        customer = User.objects.create(username='customer')
+        category = Category.objects.create(title='appetizer')
+        bread = MenuItem.objects.create(title='bread', price=2, category=category)
+        Cart.objects.create(user=customer, menuitem=bread, quantity=1, unit_price=2, price=2)
+        self.client.force_authenticate(user=customer)
+        self.client.post(ORDERS_URL)
+
+        reading = threading.Event()
+        resume = threading.Event()
+
+        def pause(execute, sql, params, many, context):
+            if not reading.is_set() and 'LittleLemonAPI_archivedorder' in sql:
+                reading.set()
+                resume.wait(5)
+            return execute(sql, params, many, context)
+
+        def rebuild():
+            try:
+                with connections['default'].execute_wrapper(pause):
+                    call_command('rebuild_order_stats', stdout=StringIO())
+            finally:
+                connections.close_all()
+
+        def checkout():
+            try:
+                Cart.objects.create(user=customer, menuitem=bread, quantity=1, unit_price=2, price=2)
+                client = APIClient()
+                client.force_authenticate(user=customer)
+                client.post(ORDERS_URL)
+            finally:
+                connections.close_all()
+
+        rebuilding = threading.Thread(target=rebuild)
+        rebuilding.start()
+        reading.wait(5)
+        checking_out = threading.Thread(target=checkout)
+        checking_out.start()
+        checking_out.join(0.5)
+        resume.set()
+        rebuilding.join()
+        checking_out.join()
+
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(UserOrderStats.objects.get(user=customer).order_count, 2)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import MenuItemsView, ManagersView, DeliveryCrewView, CartView, OrdersView, SingleOrderView
+from .views import MenuItemsView, MenuChangesView, ManagersView, DeliveryCrewView, CartView, OrdersView, OrderSummaryView, SingleOrderView, BatchView
 
 list = {
     'get':'list',
@@ -15,11 +15,14 @@ detail = {
 urlpatterns = [
     path('menu-items', MenuItemsView.as_view(list), name='menuitems_list'),
     path('menu-items/<int:pk>', MenuItemsView.as_view(detail)),
-    path('groups/manager/users', ManagersView.as_view()),
+    path('menu-items/changes', MenuChangesView.as_view(), name='menuitems_changes'),
+    path('groups/manager/users', ManagersView.as_view(), name='managers'),
     path('groups/manager/users/<int:pk>', ManagersView.as_view()),
-    path('groups/delivery-crew/users', DeliveryCrewView.as_view()),
+    path('groups/delivery-crew/users', DeliveryCrewView.as_view(), name='delivery_crew'),
     path('groups/delivery-crew/users/<int:pk>', DeliveryCrewView.as_view()),
     path('cart/menu-items', CartView.as_view(), name='cart'),
     path('orders', OrdersView.as_view(), name='orders_list'),
+    path('orders/summary', OrderSummaryView.as_view(), name='orders_summary'),
     path('orders/<int:pk>', SingleOrderView.as_view(), name='orders_detail'),
+    path('batch', BatchView.as_view(), name='batch'),
 ]
\ No newline at end of file
@@ -1,16 +1,47 @@
 from abc import abstractmethod
 from django.shortcuts import render
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.cache import caches
+from django.db import connections
+from django.urls import resolve, Resolver404
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User, Group
 from rest_framework.generics import ListCreateAPIView, DestroyAPIView, RetrieveUpdateAPIView
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import BasePermission, DjangoModelPermissionsOrAnonReadOnly
+from rest_framework.permissions import BasePermission, DjangoModelPermissionsOrAnonReadOnly, IsAuthenticated, SAFE_METHODS
 from rest_framework.exceptions import ParseError, NotFound, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
-from .models import MenuItem, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, UserSerializer, CartItemSerializer, OrderSerializer
+from django.db import transaction
+from django.db.models import Case, Count, Max, Value, When
+from .models import Category, MenuItem, Order, OrderItem, ArchivedOrder, MenuVersion, MenuTombstone, UserOrderStats
+from .archive import reaches_archive
+from .querysets import MergedQuerySet
+from .snapshots import get_menu_snapshot, get_menu_version
+from .coalescing import coalesce
+from .inventory import OutOfStock, return_stock, take_stock
+from .carts import get_cart_store
+from .idempotency import idempotent
+from .outbox import record_order_events
+from .stats import record_deliveries, record_order, update_status
+from .sharding import get_shards, shard_for_user, locate_orders
+from .serializers import CategorySerializer, MenuItemSerializer, UserSerializer, UserOrderStatsSerializer, GroupUsersSerializer, CartItemSerializer, OrderSerializer, OrderBulkUpdateSerializer, BatchSerializer
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO
+from urllib.parse import urlsplit
+import json
+import logging
 from datetime import date
+from decimal import Decimal, InvalidOperation
+from hashlib import sha256
+
+logger = logging.getLogger('django.request')
 
 class IsManager(BasePermission):
     def has_permission(self, request, view):
@@ -23,6 +54,73 @@ class IsDelivery(BasePermission):
 class ListPagination(PageNumberPagination):
     page_size = 10
 
+class PrerenderedResponse(Response):
+    """
+    A JSON response whose content is already rendered
+    data is only decoded if something reads it
+    """
+    def __init__(self, content, **kwargs):
+        super().__init__(**kwargs)
+        self.prerendered = content
+
+    @property
+    def data(self):
+        if self._data is None and self.prerendered is not None:
+            self._data = json.loads(self.prerendered)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = 'application/json'
+        return self.prerendered
+
+def filter_orders_for_user(queryset, user):
+    """
+    Restricts the orders to those visible to the user
+    Managers see all orders, delivery crew the ones assigned to them, customers their own
+    """
+    groups = user.groups
+    if groups.filter(name='Manager').exists():
+        return queryset
+    elif groups.filter(name='Delivery Crew').exists():
+        return queryset.filter(delivery_crew=user)
+    else:
+        return queryset.filter(user=user)
+
+def get_order_querysets(model, user):
+    """
+    The orders (or archived orders) visible to the user, as one queryset per shard to read
+    Customers' orders are all in their own shard, managers and delivery crew read every shard
+    """
+    if user.groups.filter(name__in=['Manager', 'Delivery Crew']).exists():
+        shards = get_shards()
+    else:
+        shards = [shard_for_user(user.id)]
+    return [filter_orders_for_user(model.objects.using(db), user) for db in shards]
+
+def check_order_fields(user, keys):
+    """
+    Raises PermissionDenied if the user is not allowed to modify any of the given order fields
+    Managers can modify delivery_crew and status, delivery crew can only modify status
+    """
+    allow=set()
+    if user.groups.filter(name='Manager').exists():
+        allow=set(['delivery_crew','status'])
+    elif user.groups.filter(name='Delivery Crew').exists():
+        allow=set(['status'])
+
+    forbidden = set(keys).difference(allow)
+
+    if len(forbidden) > 0:
+        data = {}
+        for key in forbidden:
+            data[key] = 'You do not have permission to modify this field'
+        raise PermissionDenied(data)
+
 # Create your views here.
 class MenuItemsView(ModelViewSet):
     queryset = MenuItem.objects.all()
@@ -30,23 +128,145 @@ class MenuItemsView(ModelViewSet):
     permission_classes = [DjangoModelPermissionsOrAnonReadOnly,]
     pagination_class = ListPagination
 
+    # Query parameters of the list, which key its cache
+    LIST_PARAMS = ['category', 'search', 'sort', 'price_min', 'price_max', 'facets', 'page']
+
     def get_queryset(self):
         queryset = super().get_queryset()
         
         category = self.request.query_params.get('category')
         search = self.request.query_params.get('search')
+        price_min = self._get_price_param('price_min')
+        price_max = self._get_price_param('price_max')
         ordering = self.request.query_params.get('sort')
 
         if category:
             queryset = queryset.filter(category__slug=category)
         if search:
             queryset = queryset.filter(title__icontains=search)
+        if price_min is not None:
+            queryset = queryset.filter(price__gte=price_min)
+        if price_max is not None:
+            queryset = queryset.filter(price__lte=price_max)
         if ordering:
             ordering_fields = ordering.split(',')
             queryset = queryset.order_by(*ordering_fields)
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        Unfiltered and category-only JSON lists are served from the pre-rendered menu snapshot
+        Other lists are cached per query, and concurrent identical requests share one computation
+        """
+        params = set(request.query_params.keys()).difference(['category', 'page', 'format'])
+        if len(params) > 0 or request.accepted_renderer.format != 'json':
+            # Only the parameters the list reads, so that unknown ones neither split nor flood the cache
+            query = [request.query_params.get(name) for name in self.LIST_PARAMS]
+            key = 'menu-list:{}'.format(sha256(json.dumps([request.get_host(), query]).encode()).hexdigest())
+            data = coalesce(
+                caches[settings.MENU_SNAPSHOT_CACHE], key,
+                lambda: self._list_data(request, *args, **kwargs),
+                version=get_menu_version(),
+                timeout=settings.MENU_LIST_CACHE_TIMEOUT,
+                stale_timeout=settings.MENU_LIST_STALE_TIMEOUT,
+            )
+            return Response(data)
+
+        items = get_menu_snapshot(request.query_params.get('category') or None)
+        page = self.paginate_queryset(items)
+        header = json.dumps({
+            'count': self.paginator.page.paginator.count,
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+        }, separators=(',', ':'), ensure_ascii=False).encode()
+        content = header[:-1] + b',"results":[' + b','.join(page) + b']}'
+        return PrerenderedResponse(content)
+
+    def _list_data(self, request, *args, **kwargs):
+        data = super().list(request, *args, **kwargs).data
+        if request.query_params.get('facets') in ('1', 'true'):
+            data['facets'] = self._get_facets()
+        return data
+
+    def _get_price_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise ParseError({name:'Expected a price'})
+        # NaN and Infinity parse, but can't be compared with prices
+        if not value.is_finite():
+            raise ParseError({name:'Expected a price'})
+        return value
+
+    def _get_facets(self):
+        """
+        Counts of the filtered items by category, featured and price bucket (MENU_PRICE_BUCKETS)
+        Computed with a single query grouped by all three, then added up here
+        """
+        bounds = settings.MENU_PRICE_BUCKETS
+        bucket = Case(
+            *[When(price__lt=bound, then=Value(i)) for i, bound in enumerate(bounds)],
+            default=Value(len(bounds)),
+        )
+        rows = (self.get_queryset()
+            .order_by()
+            .values('category', 'category__slug', 'featured', bucket=bucket)
+            .annotate(count=Count('id')))
+
+        categories = {}
+        featured = {'true': 0, 'false': 0}
+        prices = [{'min': low, 'max': high, 'count': 0} for (low, high) in zip([None] + bounds, bounds + [None])]
+        for row in rows:
+            category = categories.setdefault(row['category'], {'id': row['category'], 'slug': row['category__slug'], 'count': 0})
+            category['count'] += row['count']
+            featured['true' if row['featured'] else 'false'] += row['count']
+            prices[row['bucket']]['count'] += row['count']
+
+        return {
+            'category': sorted(categories.values(), key=lambda category: category['id']),
+            'featured': featured,
+            'price': prices,
+        }
+
+class MenuChangesView(APIView):
+    """
+    Menu items and categories created, updated or deleted since the given version
+    Clients keep the returned version and send it as ?since= on their next sync; without it, the whole menu is returned
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            raise ParseError({'since':'Expected a version number'})
+
+        # Read first, so that changes made while this request runs are sent again on the next sync
+        version = MenuVersion.objects.aggregate(Max('id'))['id__max'] or 0
+
+        menuitems = MenuItem.objects.all()
+        categories = Category.objects.all()
+        tombstones = MenuTombstone.objects.none()
+        if since > 0:
+            menuitems = menuitems.filter(version__gt=since)
+            categories = categories.filter(version__gt=since)
+            tombstones = MenuTombstone.objects.filter(version__gt=since)
+
+        deleted = {'menuitem': [], 'category': []}
+        for (kind, object_id) in tombstones.values_list('kind', 'object_id'):
+            deleted[kind].append(object_id)
+
+        return Response({
+            'version': version,
+            'menu_items': MenuItemSerializer(menuitems, many=True).data,
+            'categories': CategorySerializer(categories, many=True).data,
+            'deleted_menu_items': deleted['menuitem'],
+            'deleted_categories': deleted['category'],
+        })
+
 class GroupsView(ListCreateAPIView, DestroyAPIView):
     @abstractmethod
     def __getgroupname__(self):
@@ -56,42 +276,78 @@ class GroupsView(ListCreateAPIView, DestroyAPIView):
     permission_classes = [IsManager,]
 
     def get_queryset(self):
-        return User.objects.filter(groups__name=self.__getgroupname__())
+        return User.objects.filter(groups__name=self.__getgroupname__()).select_related('order_stats')
 
-    def create(self, request, *args, **kwargs):
-        username = request.POST.get('username')
-        if username == None:
+    def _get_users(self, request):
+        """
+        Ids of the users named by `username`, or by the `usernames` list, looked up in one query
+        """
+        serializer = GroupUsersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        usernames = serializer.validated_data.get('usernames', [])
+        username = serializer.validated_data.get('username')
+        if username is not None:
+            usernames = usernames + [username]
+        if len(usernames) == 0:
             raise ParseError({'username':'Missing required parameter'})
+        if len(usernames) > settings.GROUPS_MAX_USERS:
+            raise ParseError({'usernames':f'At most {settings.GROUPS_MAX_USERS} users per request'})
+
+        users = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        missing = sorted(set(usernames) - set(users))
+        if missing:
+            raise NotFound({'username': missing})
+        return list(users.values())
+
+    def _get_group(self):
         try:
-            usr = User.objects.get(username=username)
-            grp = Group.objects.get(name=self.__getgroupname__())
-            usr.groups.add(grp)
-            return Response(status=HTTP_201_CREATED)
-        except:
+            return Group.objects.get(name=self.__getgroupname__())
+        except Group.DoesNotExist:
             raise NotFound()
-        
+
+    def create(self, request, *args, **kwargs):
+        """
+        Adds the users to the group with a single insert into the membership table
+        Users already in the group are left as they are
+        """
+        users = self._get_users(request)
+        group = self._get_group()
+        Membership = User.groups.through
+        Membership.objects.bulk_create(
+            [Membership(user_id=user, group_id=group.id) for user in users], ignore_conflicts=True)
+        return Response(status=HTTP_201_CREATED)
+
     def destroy(self, request, *args, **kwargs):
-        try:
-            usr = self.get_object()
-            grp = Group.objects.get(name=self.__getgroupname__())
-            usr.groups.remove(grp)
-            return Response(status=HTTP_204_NO_CONTENT)
-        except:
+        """
+        Removes the user in the URL, or without one, the users in the body, with a single delete
+        """
+        group = self._get_group()
+        if 'pk' in kwargs:
+            users = [kwargs['pk']]
+        else:
+            users = self._get_users(request)
+        deleted, _ = User.groups.through.objects.filter(group=group, user_id__in=users).delete()
+        if 'pk' in kwargs and deleted == 0:
             raise NotFound()
-        
+        return Response(status=HTTP_204_NO_CONTENT)
+
 class ManagersView(GroupsView):
     def __getgroupname__(self):
         return 'Manager'
 
 class DeliveryCrewView(GroupsView):
     def __getgroupname__(self):
-        return 'Delivery crew'
+        return 'Delivery Crew'
 
 class CartView(ListCreateAPIView, DestroyAPIView):
     serializer_class = CartItemSerializer
     
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user.id)
+        return get_cart_store().list(self.request.user)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         """
@@ -100,26 +356,19 @@ class CartView(ListCreateAPIView, DestroyAPIView):
         If the quantity is 0, deletes removes the item from the cart
         """
         menuitem = serializer.validated_data.get('menuitem')
+        quantity = serializer.validated_data.get('quantity')
 
-        # Delete any existing item for this user:menuitem (will be replaced)
-        existing = Cart.objects.filter(user=self.request.user, menuitem=menuitem).first()
-        if existing:
-            existing.delete()
+        if quantity > 0 and menuitem.stock is not None and menuitem.stock < quantity:
+            raise OutOfStock({'menuitem': [menuitem.id]})
 
-        # Only save if quantity is more than -0
-        quantity = serializer.validated_data.get('quantity')
-        if (quantity > 0):
-            return serializer.save(
-                user = self.request.user,
-                unit_price = menuitem.price,
-                price = menuitem.price * quantity,
-            )
+        serializer.instance = get_cart_store().set(self.request.user, menuitem, quantity)
+        return serializer.instance
     
     def destroy(self, request, *args, **kwargs):
         """
         Deletes all cart items for the current user
         """
-        Cart.objects.filter(user=self.request.user).delete()
+        get_cart_store().clear(self.request.user)
         return Response(status=HTTP_204_NO_CONTENT)
 
 class OrdersView(ListCreateAPIView):
@@ -127,24 +376,129 @@ class OrdersView(ListCreateAPIView):
     pagination_class = ListPagination
 
     def get_queryset(self):
-        groups = self.request.user.groups
+        """
+        Orders visible to the user, optionally filtered by date_from and date_to (YYYY-MM-DD)
+        Archived orders are only included when the date filter reaches into the archive
+        """
+        date_from = self._get_date_param('date_from')
+        date_to = self._get_date_param('date_to')
 
-        if groups.filter(name='Manager').exists():
-            queryset = Order.objects.all()
-        elif groups.filter(name='Delivery Crew').exists():
-            queryset = Order.objects.filter(delivery_crew=self.request.user)
-        else:
-            queryset = Order.objects.filter(user=self.request.user)
+        querysets = get_order_querysets(Order, self.request.user)
+        if reaches_archive(date_from, date_to):
+            querysets += get_order_querysets(ArchivedOrder, self.request.user)
+
+        for i, queryset in enumerate(querysets):
+            if date_from:
+                queryset = queryset.filter(date__gte=date_from)
+            if date_to:
+                queryset = queryset.filter(date__lte=date_to)
+            querysets[i] = queryset
 
+        ordering_fields = []
         ordering = self.request.query_params.get('sort')
         if ordering:
             ordering_fields = ordering.split(',')
+
+        if len(querysets) > 1:
+            return MergedQuerySet(querysets, ordering_fields)
+
+        queryset = querysets[0]
+        if ordering_fields:
             queryset = queryset.order_by(*ordering_fields)
         
         return queryset
 
+    def _get_date_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ParseError({name:'Expected a date as YYYY-MM-DD'})
+
+    def get_permissions(self):
+        if self.request.method == 'PATCH':
+            return [(IsManager | IsDelivery)()]
+        return super().get_permissions()
+
+    def patch(self, request, *args, **kwargs):
+        """
+        Updates several orders at once
+        Accepts a list of {id, status, delivery_crew}, with the same per-field permissions as a single order update
+        Orders receiving the same values are updated together, all in a single transaction per shard
+        """
+        serializer = OrderBulkUpdateSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        changes = serializer.validated_data
+        if len(changes) == 0:
+            raise ParseError('no orders to update')
+
+        ids = [change['id'] for change in changes]
+        if len(ids) != len(set(ids)):
+            raise ParseError({'id':'Each order can only appear once'})
+
+        keys = set()
+        for change in changes:
+            keys.update(change.keys())
+        keys.discard('id')
+        check_order_fields(request.user, keys)
+
+        # Every order must be visible to the current user
+        shards = locate_orders(ids)
+        owners = {}
+        for db, shard_ids in shards.items():
+            queryset = filter_orders_for_user(Order.objects.using(db), request.user)
+            owners.update(queryset.filter(id__in=shard_ids).values_list('id', 'user'))
+        missing = set(ids).difference(owners)
+        if len(missing) > 0:
+            raise NotFound({'id': sorted(missing)})
+
+        crew = set(change['delivery_crew'] for change in changes if change.get('delivery_crew') is not None)
+        if len(crew) > 0:
+            found = set(User.objects.filter(id__in=crew).values_list('id', flat=True))
+            if len(found) != len(crew):
+                raise ParseError({'delivery_crew': sorted(crew.difference(found))})
+
+        # Group the orders by the values they receive, so that each group is a single UPDATE
+        batches = defaultdict(list)
+        for change in changes:
+            values = tuple(sorted((key, value) for (key, value) in change.items() if key != 'id'))
+            batches[values].append(change['id'])
+
+        deliveries = []
+        with ExitStack() as stack:
+            # In the order of ORDER_SHARDS, like any other request locking several shards
+            for db in shards:
+                stack.enter_context(transaction.atomic(using=db))
+
+            updated = []
+            orders = []
+            for db, shard_ids in shards.items():
+                for values, batch in batches.items():
+                    batch = [id for id in batch if id in shard_ids]
+                    if len(values) == 0 or len(batch) == 0:
+                        continue
+                    fields = {('delivery_crew_id' if key == 'delivery_crew' else key): value for (key, value) in values}
+                    status = fields.pop('status', None)
+                    if status is not None:
+                        deliveries.extend(update_status(db, [(id, owners[id]) for id in batch], status))
+                    if len(fields) > 0:
+                        Order.objects.using(db).filter(id__in=batch).update(**fields)
+                    updated.extend(batch)
+                orders.extend(Order.objects.using(db).filter(id__in=shard_ids).prefetch_related('items'))
+
+            orders.sort(key=lambda order: order.id)
+            record_order_events('order.updated', [order for order in orders if order.id in updated])
+
+        # The statistics are in the default database, updated once the orders have committed
+        record_deliveries(deliveries)
+        return Response(OrderSerializer(orders, many=True).data)
+
+    @idempotent
     def create(self, request, *args, **kwargs):
-        cart = Cart.objects.filter(user=self.request.user)
+        store = get_cart_store()
+        cart = store.list(self.request.user)
         if len(cart) == 0:
             raise NotFound('cart is empty')
 
@@ -153,41 +507,89 @@ class OrdersView(ListCreateAPIView):
         for item in cart:
             total += item.price
 
-        # Create the order
-        order = Order.objects.create(
-            user=self.request.user,
-            total=total,
-            date=date.today()
-        )
+        # Stock and statistics are in the default database, in short transactions of their own (see sharding.py)
+        lines = [(item.menuitem_id, item.quantity) for item in cart]
+        with transaction.atomic():
+            take_stock(lines)
 
-        # Create the order items
-        items = []
-        for item in cart:
-            items.append(OrderItem(
-                order=order,
-                menuitem=item.menuitem,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                price=item.price
-            ))
-        OrderItem.objects.bulk_create(items)
-
-        # Empty the cart
-        cart.delete()
-
-        serializer = OrderSerializer(Order.objects.get(id=order.id))
+        shard = shard_for_user(self.request.user.id)
+        try:
+            with transaction.atomic(using=shard):
+                # Allocating the order's id is the first write, so SQLite waits for the lock rather than fail to upgrade
+                order = Order.objects.using(shard).create(
+                    user=self.request.user,
+                    total=total,
+                    date=date.today()
+                )
+
+                # Create the order items
+                items = []
+                for item in cart:
+                    items.append(OrderItem(
+                        order=order,
+                        menuitem_id=item.menuitem_id,
+                        quantity=item.quantity,
+                        unit_price=item.unit_price,
+                        price=item.price
+                    ))
+                OrderItem.objects.using(shard).bulk_create(items)
+                record_order_events('order.created', [order])
+
+                # Empty the cart
+                store.remove(self.request.user, cart)
+        except Exception:
+            return_stock(lines)
+            raise
+        record_order(order)
+
+        serializer = OrderSerializer(Order.objects.using(shard).get(id=order.id))
         return Response(serializer.data, HTTP_201_CREATED)
 
+class OrderSummaryView(APIView):
+    """
+    Order count, deliveries, lifetime spend and last order date of the current user
+    Managers can ask for any user with ?user=<id>
+    """
+    permission_classes = [IsAuthenticated,]
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        user_id = request.query_params.get('user')
+        if user_id:
+            if not IsManager().has_permission(request, self):
+                raise PermissionDenied()
+            try:
+                user = User.objects.get(id=int(user_id))
+            except (ValueError, User.DoesNotExist):
+                raise NotFound()
+
+        stats = UserOrderStats.objects.filter(user=user).first() or UserOrderStats(user=user)
+        return Response(UserOrderStatsSerializer(stats).data)
+
 class SingleOrderView(RetrieveUpdateAPIView):
     serializer_class = OrderSerializer
     
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        elif self.request.user.groups.filter(name='Delivery Crew').exists():
-            return Order.objects.filter(delivery_crew=self.request.user)
-        else:
-            return Order.objects.filter(user=self.request.user)
+        return self._get_queryset(Order)
+
+    def _get_queryset(self, model):
+        """The orders visible to the user in the shard of the requested order"""
+        shards = list(locate_orders([self.kwargs['pk']]))
+        if len(shards) == 0:
+            return model.objects.none()
+        return filter_orders_for_user(model.objects.using(shards[0]), self.request.user)
+
+    def get_object(self):
+        """
+        Falls back to the archive for orders no longer in the main table
+        Archived orders are read-only
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method not in SAFE_METHODS:
+                raise
+            return get_object_or_404(self._get_queryset(ArchivedOrder), pk=self.kwargs['pk'])
 
     def get_permissions(self):
         if ['PUT','PATCH'].__contains__(self.request.method):
@@ -199,20 +601,98 @@ class SingleOrderView(RetrieveUpdateAPIView):
         raise PermissionDenied()
 
     def perform_update(self, serializer):
-        groups = self.request.user.groups
-        allow=set()
-        if groups.filter(name='Manager').exists():
-            allow=set(['delivery_crew','status'])
-        elif groups.filter(name='Delivery Crew').exists():
-            allow=set(['status'])
-        
-        keys = set(serializer.validated_data.keys())
-        forbidden = keys.difference(allow)
+        check_order_fields(self.request.user, serializer.validated_data.keys())
+        instance = serializer.instance
+        status = serializer.validated_data.get('status')
+        deliveries = []
+        with transaction.atomic(using=instance._state.db):
+            if status is not None:
+                # The status read with the order may be stale by now
+                deliveries = update_status(instance._state.db, [(instance.id, instance.user_id)], status)
+            order = super().perform_update(serializer)
+            record_order_events('order.updated', [serializer.instance])
+        # The statistics are in the default database, updated once the order has committed
+        record_deliveries(deliveries)
+        return order
+
+class BatchView(APIView):
+    """
+    Runs several API requests in a single HTTP round-trip
+    The caller is authenticated once, and each sub-request is dispatched to its view through the URL conf
+    Read-only batches can be run concurrently by passing parallel=true
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        subrequests = serializer.validated_data['requests']
+        parallel = serializer.validated_data['parallel']
 
-        if len(forbidden) > 0:
-            data = {}
-            for key in forbidden:
-                data[key] = 'You do not have permission to modify this field'
-            raise PermissionDenied(data)
+        max_requests = settings.BATCH_MAX_REQUESTS
+        if len(subrequests) > max_requests:
+            raise ParseError({'requests':f'At most {max_requests} requests per batch'})
 
-        return super().perform_update(serializer)
\ No newline at end of file
+        if parallel and all(sub['method'] == 'GET' for sub in subrequests):
+            workers = min(len(subrequests), settings.BATCH_MAX_WORKERS) or 1
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda sub: self._dispatch_threaded(request, sub), subrequests))
+        else:
+            results = [self._dispatch(request, sub) for sub in subrequests]
+
+        return Response(results)
+
+    def _dispatch_threaded(self, request, sub):
+        """Same as _dispatch, but releases the DB connection opened by the worker thread"""
+        try:
+            return self._dispatch(request, sub)
+        finally:
+            connections.close_all()
+
+    def _dispatch(self, request, sub):
+        """
+        Builds a request for the given {method, path, body} and calls the matching view
+        Returns the status and data of the view's response
+        """
+        url = urlsplit(sub['path'])
+        # Other views, like the admin, need middleware that sub-requests don't run
+        if not url.path.startswith(settings.API_PATH_PREFIX):
+            return {'status': 400, 'body': {'detail': f'Only paths under {settings.API_PATH_PREFIX} can be batched.'}}
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return {'status': 404, 'body': {'detail': 'Not found.'}}
+        if match.func.__dict__.get('view_class') is BatchView:
+            return {'status': 400, 'body': {'detail': 'Batches cannot be nested.'}}
+
+        body = b''
+        if 'body' in sub:
+            body = json.dumps(sub['body']).encode()
+
+        environ = request._request.META.copy()
+        environ.update({
+            'REQUEST_METHOD': sub['method'],
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+        })
+        # The key belongs to the batch as a whole, not to each of its requests
+        environ.pop('HTTP_IDEMPOTENCY_KEY', None)
+        subrequest = WSGIRequest(environ)
+
+        # Reuse the outer authentication instead of running it again for every sub-request
+        if request.user.is_authenticated:
+            subrequest._force_auth_user = request.user
+            subrequest._force_auth_token = request.auth
+
+        try:
+            response = match.func(subrequest, *match.args, **match.kwargs)
+        except Exception:
+            # Only this sub-request fails, the others keep their responses
+            logger.exception('Internal Server Error in batch: %s', sub['path'])
+            return {'status': 500, 'body': {'detail': 'A server error occurred.'}}
+        data = getattr(response, 'data', None)
+        if data is None and response.content:
+            data = response.content.decode()
+        return {'status': response.status_code, 'body': data}
@@ -0,0 +1,76 @@
+"""
+Per-request overhead of the middleware stack on token-authenticated /api/ requests,
+with Django's default stack and with the API bypass from LittleLemon/middleware.py
+
+Usage: python benchmarks/middleware.py [requests per round] [rounds]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+from statistics import median
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, override_settings
+
+DEFAULT_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+def run(path, token, count):
+    # The client's handler builds its middleware chain once, so each configuration needs its own client
+    client = Client()
+    for _ in range(10):
+        client.get(path, HTTP_AUTHORIZATION=f'Token {token}')
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path, HTTP_AUTHORIZATION=f'Token {token}')
+    return (time.perf_counter() - start) / count * 1e6
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+        user = User.objects.create(username='bench')
+        token = Token.objects.create(user=user).key
+
+        path = '/api/cart/menu-items'
+        before, after = [], []
+        for i in range(rounds):
+            # Alternate which configuration goes first, so that drift over the run affects both alike
+            configurations = [(DEFAULT_MIDDLEWARE, before), (None, after)]
+            for middleware, results in configurations[::1 if i % 2 == 0 else -1]:
+                if middleware is None:
+                    results.append(run(path, token, count))
+                else:
+                    with override_settings(MIDDLEWARE=middleware):
+                        results.append(run(path, token, count))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    saved = [b - a for (b, a) in zip(before, after)]
+    print(f'GET {path} x {count}, {rounds} interleaved rounds: median (min - max) in us/request')
+    for name, results in [('default middleware', before), ('API bypass', after), ('saved', saved)]:
+        print(f'  {name + ":":20} {median(results):8.1f} ({min(results):.1f} - {max(results):.1f})')
+    print(f'  saved / default:     {median(saved) / median(before):8.0%}')
+
+if __name__ == '__main__':
+    main()
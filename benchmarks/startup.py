@@ -0,0 +1,111 @@
+"""
+Cold start of a worker: time from a new Python process to the first response from wsgi.py/asgi.py,
+with the default settings and with the slim production profile (LittleLemon/settings_production.py)
+Both run against a freshly migrated database in a temporary directory
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import os
+import subprocess
+import secrets
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Run in a fresh interpreter; prints the seconds spent booting and serving the first request
+WSGI = '''
+import sys, time
+from io import BytesIO
+start = time.perf_counter()
+from LittleLemon.wsgi import application
+booted = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/menu-items', 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+    'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+}
+status = []
+b''.join(application(environ, lambda s, h, *args: status.append(s)))
+assert status[0].startswith('200'), status
+print(booted - start, time.perf_counter() - booted)
+'''
+
+ASGI = '''
+import asyncio, time
+start = time.perf_counter()
+from LittleLemon.asgi import application
+booted = time.perf_counter()
+scope = {
+    'type': 'http', 'method': 'GET', 'path': '/api/menu-items', 'query_string': b'',
+    'headers': [(b'host', b'localhost')], 'server': ('localhost', 80),
+}
+messages = []
+requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+async def receive():
+    if requests:
+        return requests.pop()
+    # The client stays connected until the response is sent
+    await asyncio.Event().wait()
+async def send(message):
+    messages.append(message)
+asyncio.run(application(scope, receive, send))
+assert messages[0]['status'] == 200, messages[0]
+print(booted - start, time.perf_counter() - booted)
+'''
+
+# Settings module wrapping each profile, with the benchmark's database
+SETTINGS = '''
+from {module} import *
+DATABASES = {{**DATABASES, 'default': {{**DATABASES['default'], 'NAME': {database!r}}}}}
+'''
+
+def write_settings(directory):
+    """Writes a wrapper of each profile to the directory. Returns {profile: wrapper module}."""
+    database = str(Path(directory) / 'db.sqlite3')
+    modules = {}
+    for module in ['LittleLemon.settings', 'LittleLemon.settings_production']:
+        name = 'bench_' + module.replace('.', '_')
+        (Path(directory) / f'{name}.py').write_text(SETTINGS.format(module=module, database=database))
+        modules[module] = name
+    return modules
+
+def environment(directory, settings):
+    return {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': settings,
+        'PYTHONPATH': os.pathsep.join([directory, str(BASE_DIR)]),
+        'PYTHONDONTWRITEBYTECODE': '',
+        'SECRET_KEY': os.environ.get('SECRET_KEY', secrets.token_urlsafe(50)),
+    }
+
+def measure(code, env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    boot, first = map(float, output.split())
+    return total, boot, first
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as directory:
+        modules = write_settings(directory)
+        # The default profile has every app installed, so its tables cover both
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'], cwd=BASE_DIR,
+                       env=environment(directory, modules['LittleLemon.settings']), check=True)
+
+        print(f'median of {runs} runs, in ms')
+        print(f'{"":37} {"process":>8} {"boot":>8} {"1st req":>8}')
+        for name, code in [('wsgi', WSGI), ('asgi', ASGI)]:
+            for settings, module in modules.items():
+                results = [measure(code, environment(directory, module)) for _ in range(runs)]
+                total, boot, first = [median(x) * 1000 for x in zip(*results)]
+                print(f'{name} {settings:32} {total:8.1f} {boot:8.1f} {first:8.1f}')
+
+if __name__ == '__main__':
+    main()